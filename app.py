@@ -1,6 +1,6 @@
 import streamlit as st
 import os
-from utils.database import create_tables, check_user_login # Importa a função do DB
+from utils.autenticacao import sync_session, end_session
 
 # Configurações Iniciais
 st.set_page_config(
@@ -9,13 +9,11 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Inicializa as tabelas do DB (garante que existem)
-create_tables()
-
 # Inicialização do estado de sessão para Login
 if "logged_in" not in st.session_state: st.session_state["logged_in"] = False
 if "username" not in st.session_state: st.session_state["username"] = ""
 if "role" not in st.session_state: st.session_state["role"] = "guest"
+sync_session()
 
 # Função para carregar CSS (assumindo que style.css existe)
 def load_css(file_name="style.css"):
@@ -53,7 +51,5 @@ except Exception:
 if st.session_state["logged_in"]:
     st.sidebar.success(f"Logado como: **{st.session_state['username']}** ({st.session_state['role']})")
     if st.sidebar.button("Sair"):
-        st.session_state["logged_in"] = False
-        st.session_state["username"] = ""
-        st.session_state["role"] = "guest"
+        end_session()
         st.rerun()
@@ -0,0 +1,12 @@
+"""
+Benchmarks da camada de dados e das páginas.
+
+Uso (na raiz do projeto):
+
+    python -m benchmarks                       # 1k, 10k e 100k produtos
+    python -m benchmarks --sizes 1000 10000 --output resultado.json
+    python -m benchmarks --update-baseline     # grava benchmarks/baseline.json
+    python -m benchmarks.carga                 # teste de carga concorrente
+
+Cada tamanho roda num banco temporário; o banco de data/ nunca é tocado.
+"""
@@ -0,0 +1,322 @@
+# benchmarks/carga.py
+
+"""
+Teste de carga: N sessões simuladas (threads ou processos) chamando ao mesmo
+tempo as funções reais de utils/database.py, como vários celulares e caixas
+abertos no app. Cada sessão sorteia operações numa mistura de leituras,
+vendas, edições e importações de CSV, concentradas num conjunto pequeno de
+produtos para provocar disputa pelos mesmos registros.
+
+Uso (na raiz do projeto):
+
+    python -m benchmarks.carga                         # threads e processos, 8 sessões
+    python -m benchmarks.carga --modo processos --sessoes 16 --duracao 30
+    python -m benchmarks.carga --busy-timeout 0.05     # força esperas curtas pelo lock
+
+Ao final confere as invariantes do estoque: nenhuma quantidade negativa e,
+produto a produto, a soma das vendas registradas igual à baixa no estoque.
+Termina com código 1 se alguma invariante falhar.
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import random
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from utils import database as db
+from benchmarks.seed import use_temp_database, seed_catalogue
+
+SESSOES = 8
+DURACAO_S = 10.0
+PRODUTOS = 2000
+# Vendas e edições caem nestes primeiros ids (os mais disputados)
+QUENTES = 40
+# Estoque inicial dos produtos quentes, para as vendas não esgotarem logo
+ESTOQUE_QUENTES = 5000
+# Peso de cada operação no sorteio
+MISTURA = {"leitura": 60, "venda": 30, "edicao": 8, "importacao": 2}
+IMPORT_LINHAS = 20
+IMPORT_NOVOS = 5
+
+OK, SEM_ESTOQUE, BLOQUEADO, ERRO = "ok", "sem_estoque", "bloqueado", "erro"
+
+
+def _configura(caminho, busy_timeout):
+    """Aponta utils.database para o banco do teste (também nos processos filhos)."""
+    db.close_all_connections()
+    db.invalidate_produtos_cache()
+    db.DATABASE = caminho
+    if busy_timeout is not None:
+        db.BUSY_TIMEOUT_S = busy_timeout
+
+
+def _leitura(rnd, n):
+    escolha = rnd.random()
+    if escolha < 0.4:
+        db.get_produto_by_id(rnd.randint(1, n))
+    elif escolha < 0.8:
+        db.query_produtos({"marca": rnd.choice(db.MARCAS), "qtd_min": 1},
+                          limit=24, offset=24 * rnd.randint(0, 3))
+    else:
+        db.get_inventory_valuation()
+
+
+def _venda(rnd, quentes, conta):
+    qtd = rnd.randint(1, 2)
+    db.mark_produto_as_sold(rnd.randint(1, quentes), qtd, usuario="carga")
+    conta["vendidas"] += qtd
+
+
+def _edicao(rnd, quentes, conta):
+    # Como o formulário de edição: lê a ficha, outro caixa vende o mesmo
+    # produto enquanto o formulário está aberto, e a ficha é gravada de volta
+    # com a quantidade exibida. A venda do meio não pode ser desfeita.
+    p = db.get_produto_by_id(rnd.randint(1, quentes))
+    if p:
+        try:
+            db.mark_produto_as_sold(p["id"], 1, usuario="carga")
+            conta["vendidas"] += 1
+        except ValueError:
+            pass
+        preco = round(max(p["preco"] * rnd.uniform(0.95, 1.05), 0.01), 2)
+        db.update_produto(p["id"], p["nome"], preco, p["quantidade"], p["marca"],
+                          p["estilo"], p["tipo"], p["foto"], p["data_validade"],
+                          quantidade_lida=p["quantidade"])
+
+
+def _importacao(rnd, quentes, sessao):
+    # Reajusta preços de produtos existentes (sem a coluna quantidade, que
+    # então não é tocada) e cadastra alguns novos
+    linhas = ["id;nome;preco"]
+    for pid in rnd.sample(range(1, quentes + 1), min(IMPORT_LINHAS, quentes)):
+        p = db.get_produto_by_id(pid)
+        if p:
+            linhas.append(f"{pid};{p['nome']};{rnd.uniform(5, 400):.2f}")
+    for i in range(IMPORT_NOVOS):
+        linhas.append(f";Carga {sessao}-{rnd.getrandbits(32):x}-{i};{rnd.uniform(5, 400):.2f}")
+    buffer = io.BytesIO(("\n".join(linhas) + "\n").encode("utf-8"))
+    db.import_produtos_from_csv_buffer(buffer, upsert="id")
+
+
+def _bloqueio(erro):
+    texto = str(erro).lower()
+    return "locked" in texto or "busy" in texto
+
+
+def sessao(numero, n, quentes, duracao, mistura, seed):
+    """
+    Uma sessão simulada: sorteia operações até acabar o tempo. Retorna a
+    lista de amostras (operação, ms, status, unidades vendidas).
+    """
+    rnd = random.Random(seed * 1000 + numero)
+    operacoes, pesos = zip(*mistura.items())
+    amostras = []
+    fim = time.perf_counter() + duracao
+    while time.perf_counter() < fim:
+        op = rnd.choices(operacoes, pesos)[0]
+        inicio = time.perf_counter()
+        # Unidades vendidas com commit feito, mesmo que a operação falhe depois
+        conta, status = {"vendidas": 0}, OK
+        try:
+            if op == "leitura":
+                _leitura(rnd, n)
+            elif op == "venda":
+                _venda(rnd, quentes, conta)
+            elif op == "edicao":
+                _edicao(rnd, quentes, conta)
+            else:
+                _importacao(rnd, quentes, numero)
+        except sqlite3.OperationalError as e:
+            status = BLOQUEADO if _bloqueio(e) else ERRO
+        except ValueError as e:
+            status = SEM_ESTOQUE if "Estoque insuficiente" in str(e) else ERRO
+        except Exception:
+            status = ERRO
+        amostras.append((op, (time.perf_counter() - inicio) * 1000, status, conta["vendidas"]))
+    return amostras
+
+
+def _sessao_processo(caminho, busy_timeout, *args):
+    _configura(caminho, busy_timeout)
+    try:
+        return sessao(*args)
+    finally:
+        db.close_all_connections()
+
+
+def _estado(conn):
+    """Retrato do estoque para conferir as invariantes no fim."""
+    quantidades = {r["id"]: r["quantidade"]
+                   for r in conn.execute("SELECT id, quantidade FROM produtos")}
+    ultima_venda = conn.execute("SELECT COALESCE(MAX(id), 0) FROM vendas").fetchone()[0]
+    return quantidades, ultima_venda
+
+
+def verifica_invariantes(antes):
+    """
+    Compara o estoque atual com o retrato `antes`. Produtos cadastrados
+    durante o teste partem de quantidade_inicial.
+    """
+    quantidades_antes, ultima_venda = antes
+    conn = db.get_db_connection()
+    try:
+        negativos = conn.execute("SELECT COUNT(*) FROM produtos WHERE quantidade < 0").fetchone()[0]
+        vendido = {r[0]: r[1] for r in conn.execute(
+            "SELECT produto_id, SUM(quantidade) FROM vendas WHERE id > ? GROUP BY produto_id",
+            (ultima_venda,))}
+        divergentes = []
+        for r in conn.execute("SELECT id, quantidade, quantidade_inicial FROM produtos"):
+            inicial = quantidades_antes.get(r["id"], r["quantidade_inicial"] or 0)
+            baixa = inicial - r["quantidade"]
+            if baixa != vendido.get(r["id"], 0):
+                divergentes.append({"id": r["id"], "baixa": baixa,
+                                    "vendas": vendido.get(r["id"], 0)})
+    finally:
+        db.release_db_connection(conn)
+    return {
+        "quantidade_negativa": negativos,
+        "unidades_vendidas": sum(vendido.values()),
+        "produtos_divergentes": divergentes,
+    }
+
+
+def _percentil(valores, p):
+    k = (len(valores) - 1) * p / 100
+    baixo = int(k)
+    alto = min(baixo + 1, len(valores) - 1)
+    return valores[baixo] + (valores[alto] - valores[baixo]) * (k - baixo)
+
+
+def resume(amostras, duracao):
+    por_op = {}
+    for op, ms, status, _ in amostras:
+        por_op.setdefault(op, []).append((ms, status))
+    linhas = {}
+    for op, itens in sorted(por_op.items()):
+        tempos = sorted(ms for ms, _ in itens)
+        contagem = {s: 0 for s in (OK, SEM_ESTOQUE, BLOQUEADO, ERRO)}
+        for _, status in itens:
+            contagem[status] += 1
+        linhas[op] = {
+            "n": len(itens),
+            "ops_s": round(len(itens) / duracao, 1),
+            "p50_ms": round(_percentil(tempos, 50), 2),
+            "p95_ms": round(_percentil(tempos, 95), 2),
+            "p99_ms": round(_percentil(tempos, 99), 2),
+            "max_ms": round(tempos[-1], 2),
+            **contagem,
+        }
+    return linhas
+
+
+def executa(modo, sessoes, duracao, n, quentes, mistura, seed, busy_timeout=None):
+    """Semeia um banco novo, roda as sessões em paralelo e confere o resultado."""
+    with use_temp_database(prefix="carga_"):
+        seed_catalogue(n, seed=seed)
+        caminho = db.DATABASE
+        _configura(caminho, busy_timeout)
+        conn = db.get_db_connection()
+        try:
+            conn.execute("UPDATE produtos SET quantidade = ?, quantidade_inicial = ? WHERE id <= ?",
+                         (ESTOQUE_QUENTES, ESTOQUE_QUENTES, quentes))
+            conn.commit()
+            db.invalidate_produtos_cache()
+            antes = _estado(conn)
+        finally:
+            db.release_db_connection(conn)
+
+        args = [(i, n, quentes, duracao, mistura, seed) for i in range(sessoes)]
+        inicio = time.perf_counter()
+        if modo == "threads":
+            with ThreadPoolExecutor(max_workers=sessoes) as pool:
+                resultados = list(pool.map(lambda a: sessao(*a), args))
+        else:
+            # spawn: cada processo começa limpo, como um servidor separado
+            contexto = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=sessoes, mp_context=contexto) as pool:
+                futuros = [pool.submit(_sessao_processo, caminho, busy_timeout, *a) for a in args]
+                resultados = [f.result() for f in futuros]
+        decorrido = time.perf_counter() - inicio
+
+        amostras = [a for r in resultados for a in r]
+        invariantes = verifica_invariantes(antes)
+        vendidas_ok = sum(a[3] for a in amostras)
+        invariantes["vendas_confirmadas"] = vendidas_ok
+        invariantes["ok"] = (
+            invariantes["quantidade_negativa"] == 0
+            and not invariantes["produtos_divergentes"]
+            and invariantes["unidades_vendidas"] == vendidas_ok
+        )
+    return {
+        "modo": modo,
+        "sessoes": sessoes,
+        "duracao_s": round(decorrido, 2),
+        "ops_s": round(len(amostras) / decorrido, 1),
+        "bloqueios": sum(1 for a in amostras if a[2] == BLOQUEADO),
+        "operacoes": resume(amostras, decorrido),
+        "invariantes": invariantes,
+    }
+
+
+def _imprime(resultado):
+    inv = resultado["invariantes"]
+    print(f"\n[{resultado['modo']}] {resultado['sessoes']} sessões, "
+          f"{resultado['duracao_s']} s, {resultado['ops_s']} ops/s, "
+          f"{resultado['bloqueios']} esperas de lock estouradas")
+    print(f"  {'operação':<11}{'n':>7}{'ops/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+          f"{'sem est.':>10}{'lock':>7}{'erro':>6}")
+    for op, l in resultado["operacoes"].items():
+        print(f"  {op:<11}{l['n']:>7}{l['ops_s']:>9}{l['p50_ms']:>9}{l['p95_ms']:>9}"
+              f"{l['p99_ms']:>9}{l['max_ms']:>9}{l[SEM_ESTOQUE]:>10}{l[BLOQUEADO]:>7}{l[ERRO]:>6}")
+    print(f"  invariantes: {'OK' if inv['ok'] else 'FALHARAM'} — "
+          f"{inv['quantidade_negativa']} quantidades negativas, "
+          f"{len(inv['produtos_divergentes'])} produtos com baixa != vendas, "
+          f"{inv['unidades_vendidas']} unidades em vendas / {inv['vendas_confirmadas']} confirmadas")
+    for d in inv["produtos_divergentes"][:10]:
+        print(f"    produto {d['id']}: baixa {d['baixa']}, vendas {d['vendas']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.carga",
+                                     description="Teste de carga concorrente do banco.")
+    parser.add_argument("--modo", choices=("threads", "processos", "ambos"), default="ambos")
+    parser.add_argument("--sessoes", type=int, default=SESSOES)
+    parser.add_argument("--duracao", type=float, default=DURACAO_S, help="segundos por modo")
+    parser.add_argument("--produtos", type=int, default=PRODUTOS)
+    parser.add_argument("--quentes", type=int, default=QUENTES,
+                        help="quantos produtos recebem as vendas e edições")
+    for op, peso in MISTURA.items():
+        parser.add_argument(f"--peso-{op}", type=int, default=peso, dest=f"peso_{op}")
+    parser.add_argument("--busy-timeout", type=float,
+                        help=f"espera máxima pelo lock, em segundos (padrão: {db.BUSY_TIMEOUT_S})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="grava os resultados neste JSON")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    mistura = {op: getattr(args, f"peso_{op}") for op in MISTURA}
+    mistura = {op: peso for op, peso in mistura.items() if peso > 0}
+    quentes = max(1, min(args.quentes, args.produtos))
+    modos = ("threads", "processos") if args.modo == "ambos" else (args.modo,)
+    resultados = []
+    for modo in modos:
+        print(f"Rodando {args.sessoes} sessões em {modo} por {args.duracao} s...", file=sys.stderr)
+        resultado = executa(modo, args.sessoes, args.duracao, args.produtos, quentes,
+                            mistura, args.seed, args.busy_timeout)
+        _imprime(resultado)
+        resultados.append(resultado)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    return 0 if all(r["invariantes"]["ok"] for r in resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+# benchmarks/run.py
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from utils import database as db
+from utils import reposicao
+from benchmarks.seed import use_temp_database, seed_catalogue
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(RAIZ, "benchmarks", "baseline.json")
+
+SIZES = (1000, 10000, 100000)
+REPEAT = 5
+# Regressão = tempo mínimo mais lento que o da baseline em mais de TOLERANCIA
+# (fração) e em mais de PISO_S segundos (evita falso alarme em medições de
+# microssegundos). O mínimo oscila bem menos que a mediana entre execuções.
+TOLERANCIA = 0.5
+PISO_S = 0.005
+
+
+def _measure(fn, repeat, setup=None, aquecimento=0):
+    """
+    Tempos de fn (mediana e mínimo). As primeiras `aquecimento` execuções não
+    são medidas: absorvem imports e caches da primeira chamada.
+    """
+    for _ in range(aquecimento):
+        if setup:
+            setup()
+        fn()
+    tempos = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        inicio = time.perf_counter()
+        fn()
+        tempos.append(time.perf_counter() - inicio)
+    return {"median_s": statistics.median(tempos), "min_s": min(tempos), "runs": repeat}
+
+
+def _cold():
+    """Descarta os caches em memória para medir o caminho até o SQLite."""
+    db.invalidate_produtos_cache()
+    reposicao._cache.invalidate()
+
+
+def bench_import_time(repeat):
+    """
+    Import de utils.database num processo novo, com o bytecode já compilado:
+    os .pyc vão para um cache temporário (PYTHONPYCACHEPREFIX) preenchido
+    por uma importação não medida. Assim .pyc velhos no repositório ou
+    PYTHONDONTWRITEBYTECODE no ambiente não viram falsa regressão.
+    """
+    codigo = ("import time; t = time.perf_counter(); import utils.database; "
+              "print(time.perf_counter() - t)")
+    tempos = []
+    with tempfile.TemporaryDirectory(prefix="bench_pyc_") as cache:
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        for i in range(repeat + 1):
+            saida = subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ, env=env,
+                                   capture_output=True, text=True, check=True)
+            if i:
+                tempos.append(float(saida.stdout.strip()))
+    return {"import_utils_database": {
+        "median_s": statistics.median(tempos), "min_s": min(tempos), "runs": repeat,
+    }}
+
+
+def bench_data_layer(n, repeat):
+    rnd = random.Random(n)
+    pesado = 1 if n >= 100000 else min(repeat, 3)
+    ids = [rnd.randint(1, n) for _ in range(100)]
+    res = {}
+
+    res["get_all_produtos"] = _measure(db.get_all_produtos, repeat, setup=_cold)
+    db.get_all_produtos()
+    res["get_all_produtos_cached"] = _measure(db.get_all_produtos, repeat)
+    res["get_produto_by_id_x100"] = _measure(
+        lambda: [db.get_produto_by_id(i) for i in ids], repeat, setup=_cold)
+    res["query_produtos_filtro_pagina"] = _measure(
+        lambda: db.query_produtos({"marca": "Avon", "busca": "flor", "qtd_min": 1}, limit=24),
+        repeat, setup=_cold)
+    res["get_inventory_valuation"] = _measure(db.get_inventory_valuation, repeat, setup=_cold)
+    res["get_inventory_valuation_marca"] = _measure(
+        lambda: db.get_inventory_valuation(group_by="marca"), repeat, setup=_cold)
+    res["get_expiring_produtos_30d"] = _measure(
+        lambda: db.get_expiring_produtos(30, limit=100), repeat, setup=_cold)
+    res["get_sales_summary_produto"] = _measure(
+        lambda: db.get_sales_summary("30d", "produto", limit=30), repeat, setup=_cold)
+    res["get_reorder_list"] = _measure(reposicao.get_reorder_list, repeat, setup=_cold)
+
+    com_estoque = [p["id"] for p in db.query_produtos({"qtd_min": repeat + 1}, limit=50)]
+    res["mark_produto_as_sold_x50"] = _measure(
+        lambda: [db.mark_produto_as_sold(pid, 1, usuario="bench") for pid in com_estoque],
+        repeat)
+
+    res["export_produtos_to_csv_content"] = _measure(
+        db.export_produtos_to_csv_content, pesado)
+    res["generate_stock_pdf_bytes"] = _measure(db.generate_stock_pdf_bytes, pesado)
+
+    # Reimporta o próprio CSV atualizando pelo id: o tamanho do catálogo não muda
+    csv_bytes = db.export_produtos_to_csv_content().encode("utf-8")
+    res["import_produtos_from_csv_buffer"] = _measure(
+        lambda: db.import_produtos_from_csv_buffer(io.BytesIO(csv_bytes), upsert="id"),
+        pesado)
+    return res
+
+
+def _apptest(pagina):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(RAIZ, pagina), default_timeout=300)
+    # As páginas revalidam o login pelo token da sessão
+    at.session_state["session_token"] = db.create_session(db.get_user("admin"))
+    return at
+
+
+def _run_page(at):
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"Exceção na página: {[e.value for e in at.exception]}")
+
+
+def bench_pages(repeat):
+    res = {}
+    for nome, pagina in (
+        ("page_estoque_completo", "pages/estoque_completo.py"),
+        ("page_gerenciamento_produto", "pages/gerenciamento_produto.py"),
+        ("page_produto_vendido", "pages/produto_vendido.py"),
+    ):
+        # Aquecimento: o primeiro AppTest de cada página paga a compilação do
+        # script e os imports do Streamlit
+        res[nome] = _measure(lambda: _run_page(_apptest(pagina)), repeat, setup=_cold,
+                             aquecimento=1)
+
+    # Laço de filtro do estoque: só o rerun que aplica marca + busca é medido
+    estado = {}
+
+    def prepara_filtro():
+        _cold()
+        at = _apptest("pages/estoque_completo.py")
+        _run_page(at)
+        next(s for s in at.selectbox if s.label == "Filtrar por Marca").set_value("Avon")
+        next(t for t in at.text_input if t.label.startswith("Buscar")).input("flor")
+        estado["at"] = at
+
+    res["page_estoque_filtro"] = _measure(lambda: _run_page(estado["at"]), repeat,
+                                          setup=prepara_filtro, aquecimento=1)
+    return res
+
+
+def compare(results, baseline, tolerancia=TOLERANCIA, piso=PISO_S):
+    """Lista de (grupo, caso, baseline_s, atual_s) que ficaram mais lentos."""
+    regressoes = []
+    for grupo, casos in results.items():
+        for caso, medida in casos.items():
+            base = baseline.get(grupo, {}).get(caso)
+            if not base:
+                continue
+            atual, anterior = medida["min_s"], base["min_s"]
+            if atual > anterior * (1 + tolerancia) and atual - anterior > piso:
+                regressoes.append((grupo, caso, anterior, atual))
+    return regressoes
+
+
+def _imprime(results, baseline):
+    for grupo, casos in results.items():
+        print(f"\n[{grupo}]")
+        for caso, medida in casos.items():
+            base = baseline.get(grupo, {}).get(caso)
+            comparacao = ""
+            if base and base["min_s"]:
+                comparacao = f"  ({medida['min_s'] / base['min_s']:.2f}x baseline)"
+            print(f"  {caso:<34} {medida['min_s'] * 1000:10.2f} ms (mín.) "
+                  f"{medida['median_s'] * 1000:10.2f} ms (mediana){comparacao}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmarks da camada de dados e das páginas.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES),
+                        help="tamanhos de catálogo (padrão: 1000 10000 100000)")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--output", help="grava os resultados neste JSON")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="grava os resultados como nova baseline em vez de comparar")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCIA,
+                        help="fração de lentidão aceita antes de acusar regressão")
+    parser.add_argument("--no-pages", action="store_true", help="não mede as páginas (AppTest)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    results = {"import": bench_import_time(args.repeat)}
+    for n in args.sizes:
+        print(f"Semeando {n} produtos...", file=sys.stderr)
+        with use_temp_database():
+            seed_catalogue(n)
+            casos = bench_data_layer(n, args.repeat)
+            if not args.no_pages:
+                casos.update(bench_pages(args.repeat))
+        results[str(n)] = casos
+
+    documento = {
+        "meta": {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "plataforma": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(documento, f, indent=2, ensure_ascii=False)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(documento, f, indent=2, ensure_ascii=False)
+        _imprime(results, {})
+        print(f"\nBaseline gravada em {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    _imprime(results, baseline)
+    regressoes = compare(results, baseline, args.tolerance)
+    if regressoes:
+        print("\nREGRESSÕES:")
+        for grupo, caso, anterior, atual in regressoes:
+            print(f"  [{grupo}] {caso}: {anterior * 1000:.2f} ms -> {atual * 1000:.2f} ms (mín.)")
+        return 1
+    print("\nSem regressões." if baseline else "\nSem baseline para comparar.")
+    return 0
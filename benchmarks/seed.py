@@ -0,0 +1,88 @@
+# benchmarks/seed.py
+
+import contextlib
+import os
+import random
+import tempfile
+from datetime import date, datetime, timedelta
+
+from utils import database as db
+
+PALAVRAS = [
+    "Floral", "Amadeirado", "Cítrico", "Intenso", "Suave", "Noite", "Brisa",
+    "Essência", "Lavanda", "Baunilha", "Rosa", "Âmbar", "Verão", "Clássico",
+    "Sport", "Gold", "Musk", "Oriental", "Fresh", "Velvet",
+]
+
+
+@contextlib.contextmanager
+def use_temp_database(prefix="bench_"):
+    """
+    Aponta utils.database para um diretório temporário novo (banco e fotos)
+    e entrega o caminho. Conexões e caches do banco anterior são descartados;
+    na saída o banco volta a ser o anterior e o diretório é apagado.
+    """
+    anterior = db.DATABASE, db.ASSETS_DIR
+    with tempfile.TemporaryDirectory(prefix=prefix) as pasta:
+        _descarta_conexoes()
+        db.DATABASE = os.path.join(pasta, "estoque.db")
+        db.ASSETS_DIR = os.path.join(pasta, "assets")
+        try:
+            db.init_db()
+            yield pasta
+        finally:
+            _descarta_conexoes()
+            db.DATABASE, db.ASSETS_DIR = anterior
+
+
+def _descarta_conexoes():
+    db.close_all_connections()
+    db.invalidate_produtos_cache()
+    db.invalidate_users_cache()
+
+
+def seed_catalogue(n, vendas_por_produto=0.5, dias_historico=180, seed=42):
+    """
+    Cadastra n produtos sintéticos (pela importação em massa) e um histórico
+    de vendas de cerca de n * vendas_por_produto linhas nos últimos
+    dias_historico dias.
+    """
+    import pandas as pd
+
+    rnd = random.Random(seed)
+    hoje = date.today()
+    linhas = []
+    for i in range(n):
+        nome = " ".join(rnd.sample(PALAVRAS, 3)) + f" {i}"
+        validade = hoje + timedelta(days=rnd.randint(-30, 720)) if rnd.random() < 0.8 else None
+        linhas.append({
+            "nome": nome,
+            "preco": round(rnd.uniform(5, 400), 2),
+            "quantidade": rnd.randint(0, 50),
+            "marca": rnd.choice(db.MARCAS),
+            "estilo": rnd.choice(db.ESTILOS),
+            "tipo": rnd.choice(db.TIPOS),
+            "data_validade": validade.isoformat() if validade else None,
+        })
+    db.import_produtos_from_dataframe(pd.DataFrame(linhas))
+
+    n_vendas = int(n * vendas_por_produto)
+    if n_vendas:
+        agora = datetime.now()
+        vendas = [
+            (rnd.randint(1, n), rnd.randint(1, 3), round(rnd.uniform(5, 400), 2),
+             (agora - timedelta(days=rnd.random() * dias_historico)).isoformat(), "bench")
+            for _ in range(n_vendas)
+        ]
+        vendas.sort(key=lambda v: v[3])
+        conn = db.get_db_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO vendas (produto_id, quantidade, preco_unitario, data, usuario) "
+                "VALUES (?, ?, ?, ?, ?)", vendas
+            )
+            conn.commit()
+        finally:
+            db.release_db_connection(conn)
+    db.invalidate_produtos_cache()
@@ -1,9 +1,10 @@
 import streamlit as st
 from datetime import datetime
 from utils.database import (
-    add_produto, get_all_produtos, mark_produto_as_sold,
+    add_produto, query_produtos, mark_produto_as_sold, search_produtos,
     MARCAS, ESTILOS, TIPOS, safe_int, safe_float
 )
+from utils.autenticacao import sync_session
 
 st.set_page_config(page_title="Chatbot Estoque", page_icon="🤖", layout="wide")
 
@@ -17,6 +18,7 @@ def load_css(file_name="style.css"):
             pass
 
 load_css("style.css")
+sync_session()
 
 if not st.session_state.get("logged_in"):
     st.error("Acesso negado. Faça login na Área Administrativa.")
@@ -46,6 +48,7 @@ def process_command(user_input: str) -> str:
                 "Comandos:\n"
                 "- `adicionar produto`\n"
                 "- `estoque`\n"
+                "- `buscar [termo]`\n"
                 "- `vender [ID]`\n"
                 "- `cancelar`"
             )
@@ -56,26 +59,37 @@ def process_command(user_input: str) -> str:
             partes = text.split()
             if len(partes) > 1 and partes[1].isdigit():
                 try:
-                    mark_produto_as_sold(int(partes[1]), 1)
+                    mark_produto_as_sold(int(partes[1]), 1, usuario=st.session_state.get("username"))
                     return f"Venda registrada para ID {partes[1]}."
                 except Exception as e:
                     return f"Erro na venda: {e}"
             else:
                 state["step"] = "vender_id"
                 return "Informe o ID do produto para vender 1 unidade."
+        if text.startswith("buscar"):
+            termo = user_input.strip()[len("buscar"):].strip()
+            if not termo:
+                return "Informe o que buscar. Ex: `buscar perfume floral`"
+            achados = search_produtos(termo, limit=10)
+            if not achados:
+                return f"Nenhum produto encontrado para '{termo}'."
+            resp = "Produtos encontrados:\n"
+            for p in achados:
+                resp += f"- ID {p['id']}: {p['nome']} ({p['quantidade']} un)\n"
+            return resp
         if "estoque" in text:
-            prods = get_all_produtos(include_sold=False)
+            prods = query_produtos({"qtd_min": 1}, limit=10)
             if not prods:
                 return "Nenhum produto em estoque."
             resp = "Itens em estoque:\n"
-            for p in prods[:10]:
+            for p in prods:
                 resp += f"- ID {p['id']}: {p['nome']} ({p['quantidade']} un)\n"
             return resp
 
     if state["step"] == "vender_id":
         if text.isdigit():
             try:
-                mark_produto_as_sold(int(text), 1)
+                mark_produto_as_sold(int(text), 1, usuario=st.session_state.get("username"))
                 st.session_state["chat_state"] = {"step": "idle", "data": {}}
                 return f"Venda registrada para ID {text}."
             except Exception as e:
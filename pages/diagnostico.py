@@ -0,0 +1,114 @@
+import streamlit as st
+import os
+from datetime import datetime
+from utils import instrumentacao
+from utils.autenticacao import sync_session
+
+st.set_page_config(page_title="Diagnóstico", page_icon="🩺", layout="wide")
+
+def load_css(file_name="style.css"):
+    if os.path.exists(file_name):
+        try:
+            with open(file_name, encoding="utf-8") as f:
+                st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        except Exception:
+            pass
+
+load_css("style.css")
+sync_session()
+
+if not st.session_state.get("logged_in") or st.session_state.get("role") != "admin":
+    st.error("🚫 Apenas administradores podem ver o diagnóstico.")
+    st.stop()
+
+st.title("🩺 Diagnóstico de Desempenho")
+st.caption(
+    "Tempos registrados por este processo do servidor (todas as sessões), "
+    f"nos últimos {instrumentacao.RING_SIZE} eventos."
+)
+if not instrumentacao.ATIVA:
+    st.warning("Instrumentação desligada (ESTOQUE_INSTRUMENTACAO=0).")
+st.markdown("---")
+
+eventos = instrumentacao.get_eventos()
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Eventos no buffer", len(eventos))
+col2.metric("Execuções de página", sum(1 for e in eventos if e["tipo"] == "pagina"))
+col3.metric("Chamadas ao banco", sum(1 for e in eventos if e["tipo"] == "db"))
+col4.metric("Conexões abertas (total)", instrumentacao.conexoes_abertas)
+
+# =========================
+# PÁGINAS
+# =========================
+st.subheader("📄 Páginas")
+paginas = instrumentacao.resumo("pagina")
+if paginas:
+    st.dataframe(paginas, hide_index=True, use_container_width=True,
+                 column_config={"nome": "Página", "n": "Execuções", "linhas": None})
+    secoes = instrumentacao.resumo("secao")
+    st.caption("Seções (todas as páginas)")
+    st.dataframe(secoes, hide_index=True, use_container_width=True,
+                 column_config={"nome": "Seção", "n": "Execuções", "linhas": None})
+else:
+    st.info("Nenhuma página medida ainda. Navegue pelo app e volte aqui.")
+
+# =========================
+# BANCO
+# =========================
+st.subheader("🗄️ Banco de dados")
+colb1, colb2 = st.columns(2)
+with colb1:
+    st.caption("Por função (p95 mais alto primeiro)")
+    st.dataframe(instrumentacao.resumo("db"), hide_index=True, use_container_width=True,
+                 column_config={"nome": "Função", "n": "Chamadas", "linhas": "Linhas"})
+with colb2:
+    st.caption("Chamadas mais lentas")
+    st.dataframe(
+        [{"Função": e["nome"], "ms": e["ms"], "Linhas": e.get("linhas"),
+          "Página": e["pagina"] or "-", "Erro": e.get("erro") or "",
+          "Quando": datetime.fromtimestamp(e["ts"]).strftime("%H:%M:%S")}
+         for e in instrumentacao.mais_lentas(20)],
+        hide_index=True, use_container_width=True,
+    )
+conexoes = instrumentacao.resumo("conexao")
+imagens = instrumentacao.resumo("imagem")
+colc1, colc2 = st.columns(2)
+with colc1:
+    st.caption("Empréstimo de conexões do pool")
+    novas = sum(1 for e in eventos if e["tipo"] == "conexao" and e.get("nova"))
+    st.write(f"{sum(c['n'] for c in conexoes)} empréstimos, {novas} conexões novas "
+             f"(p95 {conexoes[0]['p95_ms'] if conexoes else 0} ms)")
+with colc2:
+    st.caption("Miniaturas")
+    st.write(f"{sum(i['n'] for i in imagens)} carregamentos "
+             f"(p95 {imagens[0]['p95_ms'] if imagens else 0} ms)")
+
+# =========================
+# PERFIS
+# =========================
+st.subheader("🔬 Perfis (cProfile)")
+colp1, colp2 = st.columns([1, 3], vertical_alignment="bottom")
+with colp1:
+    quantidade = st.number_input("Execuções a capturar", min_value=1, max_value=10, value=1)
+with colp2:
+    if st.button("Capturar próximas execuções de página"):
+        instrumentacao.capturar_perfis(quantidade)
+        st.success(f"As próximas {quantidade} execuções de página serão perfiladas.")
+for perfil in reversed(instrumentacao.get_perfis()):
+    quando = datetime.fromtimestamp(perfil["ts"]).strftime("%H:%M:%S")
+    with st.expander(f"{perfil['pagina']} • {perfil['ms']:.0f} ms • {quando}"):
+        st.code(perfil["texto"], language=None)
+
+# =========================
+# EXPORTAÇÃO
+# =========================
+st.markdown("---")
+cole1, cole2 = st.columns(2)
+with cole1:
+    st.download_button("Exportar eventos (JSON lines)", instrumentacao.exportar_jsonl,
+                       f"diagnostico_{datetime.now().strftime('%Y%m%d_%H%M')}.jsonl",
+                       "application/x-ndjson")
+with cole2:
+    if st.button("Limpar buffer"):
+        instrumentacao.limpar()
+        st.rerun()
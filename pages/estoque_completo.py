@@ -1,9 +1,15 @@
 import streamlit as st
 import os
 from datetime import datetime
-from utils.database import get_all_produtos, ASSETS_DIR, MARCAS, ESTILOS, TIPOS, safe_int, safe_float
+from utils.database import (
+    query_produtos, get_produtos_summary, get_distinct_values, get_expiring_produtos,
+    count_expired_produtos, MARCAS, ESTILOS, TIPOS, safe_int, safe_float
+)
+from utils.thumbnails import get_thumbnail
+from utils import instrumentacao
 
 st.set_page_config(page_title="Estoque Completo", page_icon="📦", layout="wide")
+rerun = instrumentacao.pagina("Estoque Completo")
 
 def format_to_brl(value):
     try:
@@ -13,6 +19,9 @@ def format_to_brl(value):
     except Exception:
         return "R$ N/A"
 
+def format_date(iso):
+    return "/".join(reversed(iso.split("-"))) if iso else "-"
+
 def load_css(file_name="style.css"):
     if os.path.exists(file_name):
         try:
@@ -26,17 +35,36 @@ load_css("style.css")
 st.title("📦 Estoque Completo - Cores e Fragrâncias")
 st.markdown("---")
 
-produtos = get_all_produtos(include_sold=True)
-if not produtos:
+POR_PAGINA = [24, 48, 96]
+
+rerun.secao("resumo")
+if get_produtos_summary()["total"] == 0:
     st.info("Nenhum produto cadastrado.")
+    rerun.fim()
     st.stop()
 
-def get_unique(field):
-    return sorted(list(set(p.get(field, "") for p in produtos if p.get(field))))
-
-marcas = get_unique("marca") or MARCAS
-estilos = get_unique("estilo") or ESTILOS
-tipos = get_unique("tipo") or TIPOS
+rerun.secao("validade")
+with st.expander("⏰ Validade próxima"):
+    dias = st.selectbox("Vencem em até", [7, 15, 30, 60, 90], index=2,
+                        format_func=lambda d: f"{d} dias")
+    vencendo = get_expiring_produtos(dias, limit=100, include_expired=False)
+    vencidos = count_expired_produtos()
+    if vencidos:
+        st.error(f"{vencidos} produto(s) com validade vencida.")
+    if not vencendo:
+        st.caption("Nenhum produto em estoque vence nesse período.")
+    else:
+        st.dataframe(
+            [{"Produto": p["nome"], "Marca": p.get("marca") or "-",
+              "Qtd": safe_int(p["quantidade"]), "Validade": format_date(p["data_validade"]),
+              "Dias": p["dias_restantes"]} for p in vencendo],
+            hide_index=True, use_container_width=True,
+        )
+
+rerun.secao("filtros")
+marcas = get_distinct_values("marca") or MARCAS
+estilos = get_distinct_values("estilo") or ESTILOS
+tipos = get_distinct_values("tipo") or TIPOS
 
 col1, col2, col3 = st.columns(3)
 with col1:
@@ -50,47 +78,49 @@ col4, col5 = st.columns(2)
 with col4:
     qtd_min = st.number_input("Quantidade mínima", min_value=0, value=0)
 with col5:
-    busca = st.text_input("Buscar por nome")
-
-produtos_filtrados = produtos[:]
-if marca_f != "Todas":
-    produtos_filtrados = [p for p in produtos_filtrados if p.get("marca") == marca_f]
-if estilo_f != "Todos":
-    produtos_filtrados = [p for p in produtos_filtrados if p.get("estilo") == estilo_f]
-if tipo_f != "Todos":
-    produtos_filtrados = [p for p in produtos_filtrados if p.get("tipo") == tipo_f]
-if qtd_min > 0:
-    produtos_filtrados = [p for p in produtos_filtrados if safe_int(p.get("quantidade", 0)) >= qtd_min]
-if busca:
-    produtos_filtrados = [p for p in produtos_filtrados if busca.lower() in p.get("nome", "").lower()]
-
-if not produtos_filtrados:
+    busca = st.text_input("Buscar (nome, marca, estilo ou tipo)")
+
+filtros = {
+    "marca": marca_f if marca_f != "Todas" else None,
+    "estilo": estilo_f if estilo_f != "Todos" else None,
+    "tipo": tipo_f if tipo_f != "Todos" else None,
+    "qtd_min": qtd_min,
+    "busca": busca,
+}
+
+resumo = get_produtos_summary(filtros)
+if resumo["total"] == 0:
     st.warning("Nenhum produto encontrado com esses filtros.")
+    rerun.fim()
     st.stop()
 
-total = 0.0
-for p in produtos_filtrados:
-    total += safe_float(p.get("preco", 0)) * safe_int(p.get("quantidade", 0))
-
 colm1, colm2 = st.columns(2)
 with colm1:
-    st.metric("Produtos filtrados", len(produtos_filtrados))
+    st.metric("Produtos filtrados", resumo["total"])
 with colm2:
-    st.metric("Valor total filtrado", format_to_brl(total))
+    st.metric("Valor total filtrado", format_to_brl(resumo["valor"]))
+
+colp1, colp2 = st.columns(2)
+with colp1:
+    por_pagina = st.selectbox("Itens por página", POR_PAGINA)
+total_paginas = max((resumo["total"] + por_pagina - 1) // por_pagina, 1)
+with colp2:
+    pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1)
+st.caption(f"Página {pagina} de {total_paginas}")
+
+rerun.secao("consulta")
+produtos_filtrados = query_produtos(filtros, limit=por_pagina, offset=(pagina - 1) * por_pagina)
 
 st.markdown("---")
 
+rerun.secao("cards")
 for p in produtos_filtrados:
     with st.container(border=True):
         col_img, col_info = st.columns([1, 3])
         with col_img:
-            foto = p.get("foto")
-            if foto:
-                path = os.path.join(ASSETS_DIR, foto)
-                if os.path.exists(path):
-                    st.image(path, width=120, use_container_width=True)
-                else:
-                    st.caption("Sem foto")
+            thumb = get_thumbnail(p.get("foto"))
+            if thumb:
+                st.image(thumb, width=120)
             else:
                 st.caption("Sem foto")
         with col_info:
@@ -102,3 +132,4 @@ for p in produtos_filtrados:
 
 st.markdown("---")
 st.caption(f"Atualizado em {datetime.now().strftime('%d/%m/%Y %H:%M')}")
+rerun.fim()
@@ -3,22 +3,19 @@ import streamlit as st
 import os
 from datetime import datetime
 from utils.database import (
-    create_tables,
-    get_all_produtos,
+    get_produtos_summary,
     add_user,
     get_user,
     get_all_users,
-    hash_password,
+    check_user_login,
     update_user_role,
     delete_user,
 )
+from utils.autenticacao import start_session, end_session, sync_session
 
 # Configuração da página
 st.set_page_config(page_title="Cores e Fragrâncias", page_icon="🌸", layout="wide")
 
-# Cria tabelas se não existirem
-create_tables()
-
 # --- Função para carregar CSS ---
 def load_css(file_name):
     """Carrega e aplica o CSS personalizado, forçando a codificação UTF-8."""
@@ -41,6 +38,7 @@ if "role" not in st.session_state:
     st.session_state["role"] = "guest"
 if "username" not in st.session_state:
     st.session_state["username"] = None
+sync_session()
 
 # --- HEADER PRINCIPAL ---
 st.title("🌸 Cores e Fragrâncias by Berenice")
@@ -50,7 +48,7 @@ st.write("Use o menu abaixo para acessar funcionalidades:")
 
 col1, col2 = st.columns(2)
 with col1:
-    st.metric("Produtos cadastrados", len(get_all_produtos()))
+    st.metric("Produtos cadastrados", get_produtos_summary()["total"])
 with col2:
     st.metric("Status", "Online ✅")
 
@@ -64,9 +62,7 @@ if st.session_state.get("logged_in"):
         f"({st.session_state['role'].title()})"
     )
     if st.sidebar.button("🚪 Logout"):
-        st.session_state["logged_in"] = False
-        st.session_state["username"] = None
-        st.session_state["role"] = "guest"
+        end_session()
         st.success("Sessão encerrada com sucesso!")
         st.rerun()
 
@@ -90,14 +86,11 @@ if option == "Login":
         if not username or not password:
             st.error("Preencha usuário e senha.")
         else:
-            user = get_user(username)
-            if not user:
-                st.error("❌ Usuário não encontrado.")
-            elif hash_password(password) == user.get("password"):
+            # Verificação lenta (KDF) só aqui; os reruns seguintes usam a sessão
+            user = check_user_login(username, password)
+            if user:
                 st.success(f"✅ Bem-vindo(a), **{username}** ({user.get('role').title()})!")
-                st.session_state["logged_in"] = True
-                st.session_state["username"] = username
-                st.session_state["role"] = user.get('role')
+                start_session(user)
                 st.rerun()
             else:
                 st.error("❌ Usuário ou senha incorretos.")
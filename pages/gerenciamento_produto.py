@@ -1,15 +1,28 @@
 import streamlit as st
 import os
-from datetime import datetime, date
+from datetime import date
+from functools import partial
 from utils.database import (
-    add_produto, get_all_produtos, update_produto, delete_produto, get_produto_by_id,
-    export_produtos_to_csv_content, import_produtos_from_csv_buffer, generate_stock_pdf_bytes,
-    mark_produto_as_sold,
+    add_produto, query_produtos, get_produtos_summary, update_produto, delete_produto,
+    get_produto_by_id, get_distinct_values, get_produto_ids, bulk_update_prices,
+    bulk_restock_by_filter, bulk_delete, apply_produto_changes,
+    get_expiring_produtos, count_expired_produtos,
+    mark_produto_as_sold, save_foto, get_inventory_valuation,
     MARCAS, ESTILOS, TIPOS, ASSETS_DIR, safe_int, safe_float
 )
+from utils.thumbnails import generate_thumbnails, get_thumbnail
+from utils import instrumentacao
+from utils.autenticacao import sync_session
+from utils.tarefas import (
+    submit_tarefa, list_tarefas, get_resultado_bytes, ATIVAS, CONCLUIDA, ERRO, MIME,
+    EXPORT_FORMATOS
+)
 
 st.set_page_config(page_title="Gerenciar Produtos", page_icon="🛠️", layout="wide")
 
+def format_date(iso):
+    return "/".join(reversed(iso.split("-"))) if iso else "-"
+
 def load_css(file_name="style.css"):
     if os.path.exists(file_name):
         try:
@@ -27,6 +40,7 @@ def format_to_brl(value):
         return "R$ N/A"
 
 load_css("style.css")
+sync_session()
 
 if not st.session_state.get("logged_in"):
     st.error("Acesso restrito. Faça login na Área Administrativa.")
@@ -38,6 +52,10 @@ if "edit_product_id" not in st.session_state:
     st.session_state["edit_product_id"] = None
 if "role" not in st.session_state:
     st.session_state["role"] = "staff"
+if "grid_versao" not in st.session_state:
+    st.session_state["grid_versao"] = 0
+
+POR_PAGINA = [25, 50, 100]
 
 st.title("🛠️ Gerenciar Produtos")
 st.markdown("---")
@@ -65,9 +83,11 @@ def add_product_form():
                 return
             photo_name = None
             if foto:
-                photo_name = f"{int(datetime.now().timestamp())}_{foto.name}"
-                with open(os.path.join(ASSETS_DIR, photo_name), "wb") as f:
-                    f.write(foto.getbuffer())
+                photo_name = save_foto(foto.getbuffer(), foto.name)
+                try:
+                    generate_thumbnails(os.path.join(ASSETS_DIR, photo_name))
+                except Exception:
+                    pass
             validade_iso = data_validade.isoformat() if data_validade else None
             try:
                 add_produto(nome, preco, quantidade, marca, estilo, tipo, photo_name, validade_iso)
@@ -76,26 +96,39 @@ def add_product_form():
             except Exception as e:
                 st.error(f"Erro ao salvar produto: {e}")
 
+def _fecha_edicao():
+    st.session_state["edit_mode"] = False
+    st.session_state.pop("edit_exibido", None)
+
 def show_edit_form():
     produto_id = st.session_state.get("edit_product_id")
     p = get_produto_by_id(produto_id)
     if not p:
         st.error("Produto não encontrado.")
-        st.session_state["edit_mode"] = False
+        _fecha_edicao()
         st.rerun()
-    st.subheader(f"✏️ Editando: {p['nome']} (ID {p['id']})")
+    # O formulário mostra o produto como estava ao abrir: a quantidade exibida
+    # vai como quantidade_lida, e vendas feitas enquanto ele está aberto não
+    # são desfeitas. As chaves fixas mantêm o que foi digitado entre reruns.
+    exibido = st.session_state.get("edit_exibido")
+    if not exibido or exibido["id"] != produto_id:
+        exibido = st.session_state["edit_exibido"] = dict(p)
+    st.subheader(f"✏️ Editando: {exibido['nome']} (ID {produto_id})")
     with st.form("edit_form"):
         col1, col2 = st.columns([2, 1])
         with col1:
-            novo_nome = st.text_input("Nome", value=p["nome"])
-            novo_preco = st.number_input("Preço", value=safe_float(p["preco"]), format="%.2f")
-            nova_qtd = st.number_input("Quantidade", value=safe_int(p["quantidade"]), min_value=0)
-            marca_idx = MARCAS.index(p["marca"]) if p.get("marca") in MARCAS else 0
-            estilo_idx = ESTILOS.index(p["estilo"]) if p.get("estilo") in ESTILOS else 0
-            tipo_idx = TIPOS.index(p["tipo"]) if p.get("tipo") in TIPOS else 0
-            nova_marca = st.selectbox("Marca", MARCAS, index=marca_idx)
-            novo_estilo = st.selectbox("Estilo", ESTILOS, index=estilo_idx)
-            novo_tipo = st.selectbox("Tipo", TIPOS, index=tipo_idx)
+            novo_nome = st.text_input("Nome", value=exibido["nome"], key=f"edit_nome_{produto_id}")
+            novo_preco = st.number_input("Preço", value=safe_float(exibido["preco"]), format="%.2f",
+                                         key=f"edit_preco_{produto_id}")
+            nova_qtd = st.number_input("Quantidade", value=safe_int(exibido["quantidade"]),
+                                       min_value=0, key=f"edit_qtd_{produto_id}")
+            marca_idx = MARCAS.index(exibido["marca"]) if exibido.get("marca") in MARCAS else 0
+            estilo_idx = ESTILOS.index(exibido["estilo"]) if exibido.get("estilo") in ESTILOS else 0
+            tipo_idx = TIPOS.index(exibido["tipo"]) if exibido.get("tipo") in TIPOS else 0
+            nova_marca = st.selectbox("Marca", MARCAS, index=marca_idx, key=f"edit_marca_{produto_id}")
+            novo_estilo = st.selectbox("Estilo", ESTILOS, index=estilo_idx,
+                                       key=f"edit_estilo_{produto_id}")
+            novo_tipo = st.selectbox("Tipo", TIPOS, index=tipo_idx, key=f"edit_tipo_{produto_id}")
         with col2:
             st.info(f"Foto atual: {p.get('foto') or 'Sem foto'}")
             nova_foto = st.file_uploader("Nova foto (opcional)", type=["jpg", "png", "jpeg"])
@@ -107,73 +140,386 @@ def show_edit_form():
         if salvar:
             foto_final = p.get("foto")
             if nova_foto:
-                if foto_final:
-                    try:
-                        os.remove(os.path.join(ASSETS_DIR, foto_final))
-                    except Exception:
-                        pass
-                foto_final = f"{int(datetime.now().timestamp())}_{nova_foto.name}"
-                with open(os.path.join(ASSETS_DIR, foto_final), "wb") as f:
-                    f.write(nova_foto.getbuffer())
+                # A foto anterior só é apagada por update_produto se ficar sem uso
+                foto_final = save_foto(nova_foto.getbuffer(), nova_foto.name)
+                try:
+                    generate_thumbnails(os.path.join(ASSETS_DIR, foto_final))
+                except Exception:
+                    pass
             validade_iso = p.get("data_validade")
             try:
                 update_produto(produto_id, novo_nome, novo_preco, nova_qtd,
-                               nova_marca, novo_estilo, novo_tipo, foto_final, validade_iso)
+                               nova_marca, novo_estilo, novo_tipo, foto_final, validade_iso,
+                               quantidade_lida=exibido["quantidade"])
                 st.success("Produto atualizado.")
-                st.session_state["edit_mode"] = False
+                _fecha_edicao()
                 st.rerun()
             except Exception as e:
                 st.error(f"Erro ao atualizar: {e}")
         if cancelar:
-            st.session_state["edit_mode"] = False
+            _fecha_edicao()
             st.rerun()
 
 def manage_products_list_actions():
     st.subheader("📋 Lista de Produtos")
+    # Exportações, relatório e importação rodam em segundo plano (utils/tarefas.py):
+    # a página não trava e o arquivo fica disponível em "Arquivos gerados"
+    usuario = st.session_state.get("username")
     colr1, colr2, colr3 = st.columns(3)
     with colr1:
-        csv_content = export_produtos_to_csv_content()
-        st.download_button("Exportar CSV", csv_content.encode("utf-8"),
-                           "estoque.csv", "text/csv")
+        formato = st.selectbox("Exportar produtos", EXPORT_FORMATOS, format_func=str.upper)
+        if st.button("Exportar"):
+            submit_tarefa("exportacao", {"formato": formato}, usuario=usuario)
+            st.session_state["tarefas_ativas"] = True
     with colr2:
+        agrupar = st.selectbox(
+            "Agrupar PDF por", [None, "marca", "tipo"],
+            format_func=lambda g: {None: "Sem agrupamento", "marca": "Marca", "tipo": "Tipo"}[g],
+        )
         if st.button("Gerar PDF Estoque Ativo"):
-            try:
-                pdf_bytes = generate_stock_pdf_bytes()
-                st.download_button("Baixar PDF", pdf_bytes,
-                                   "estoque_ativo.pdf", "application/pdf")
-            except Exception as e:
-                st.error(f"Erro ao gerar PDF: {e}")
+            submit_tarefa("relatorio", {"group_by": agrupar}, usuario=usuario)
+            st.session_state["tarefas_ativas"] = True
     with colr3:
-        csv_file = st.file_uploader("Importar CSV", type=["csv"])
-        if csv_file and st.button("Processar CSV"):
+        csv_file = st.file_uploader("Importar CSV / XLSX / Parquet",
+                                    type=["csv", "xlsx", "parquet"])
+        modo = st.selectbox(
+            "Produtos já cadastrados",
+            [None, "id", "nome_marca"],
+            format_func=lambda m: {
+                None: "Sempre inserir novos",
+                "id": "Atualizar pelo ID",
+                "nome_marca": "Atualizar por Nome + Marca",
+            }[m],
+        )
+        if csv_file and st.button("Processar Arquivo"):
+            extensao = csv_file.name.rsplit(".", 1)[-1].lower()
             try:
-                count = import_produtos_from_csv_buffer(csv_file)
-                st.success(f"{count} produtos importados.")
-                st.rerun()
+                submit_tarefa(
+                    "importacao",
+                    {"formato": extensao if extensao in ("xlsx", "parquet") else "csv",
+                     "upsert": modo, "nome": csv_file.name},
+                    dados=csv_file.getvalue(), usuario=usuario,
+                )
+                st.session_state["tarefas_ativas"] = True
             except Exception as e:
                 st.error(f"Erro ao importar: {e}")
 
+    jobs_panel()
     st.markdown("---")
-    produtos = get_all_produtos()
-    if not produtos:
-        st.info("Nenhum produto cadastrado.")
+    products_grid()
+
+def jobs_panel():
+    """
+    Últimas tarefas em segundo plano. Enquanto alguma estiver na fila ou
+    rodando, o painel se atualiza sozinho a cada 2 s sem recarregar a página.
+    """
+    if not list_tarefas(limit=1):
         return
-    total = 0.0
+    ativas = st.session_state.get("tarefas_ativas") or any(
+        t["status"] in ATIVAS for t in list_tarefas()
+    )
+    st.session_state["tarefas_ativas"] = ativas
+    st.fragment(_jobs_panel, run_every=2 if ativas else None)()
+
+def _jobs_panel():
+    tarefas = list_tarefas()
+    with st.expander("📂 Arquivos gerados e importações", expanded=True):
+        for t in tarefas:
+            params = t["params"]
+            if t["tipo"] == "relatorio":
+                titulo = "Relatório PDF" + (f" por {params['group_by']}" if params.get("group_by") else "")
+            elif t["tipo"] == "exportacao":
+                titulo = f"Exportação {params['formato'].upper()}"
+            else:
+                titulo = f"Importação de {params.get('nome') or params['formato'].upper()}"
+            quando = t["criada_em"][11:16]
+            legenda = f"{titulo} • {t['usuario'] or '-'} às {quando}"
+            if t["status"] in ATIVAS:
+                st.progress(t["progresso"], text=f"{legenda} • {round(t['progresso'] * 100)}%")
+            elif t["status"] == ERRO:
+                st.error(f"{legenda} • falhou: {t['erro']}")
+            elif t["arquivo"]:
+                extensao = t["nome_arquivo"].rsplit(".", 1)[-1]
+                st.download_button(
+                    f"⬇️ {legenda}", partial(get_resultado_bytes, t["id"]), t["nome_arquivo"],
+                    MIME.get(extensao, "application/octet-stream"), key=f"tarefa_{t['id']}",
+                )
+            elif t["status"] == CONCLUIDA and t["resultado"]:
+                res = t["resultado"]
+                st.success(
+                    f"{legenda} • {res['inserted']} inseridos, {res['updated']} atualizados, "
+                    f"{res['skipped']} ignorados."
+                )
+                for linha, motivo in res["errors"][:5]:
+                    st.caption(f"Linha {linha}: {motivo}")
+    if st.session_state.get("tarefas_ativas") and not any(t["status"] in ATIVAS for t in tarefas):
+        # Tudo terminou: recarrega a página inteira (para o polling e mostra
+        # os produtos importados)
+        st.session_state["tarefas_ativas"] = False
+        st.rerun()
+
+@st.fragment
+def products_grid():
+    """
+    Lista paginada: só a página visível é buscada e desenhada, e as ações
+    reexecutam apenas este fragmento, não a página inteira.
+    """
+    # Reruns só do fragmento não passam pelo topo da página: medidos à parte
+    rerun = None
+    if instrumentacao.rerun_atual() is None:
+        rerun = instrumentacao.pagina("Gerenciar Produtos (lista)")
+    try:
+        _products_grid()
+    finally:
+        if rerun:
+            rerun.fim()
+
+def _products_grid():
+    colf1, colf2, colf3 = st.columns([2, 1, 1])
+    with colf1:
+        busca = st.text_input("Buscar (nome, marca, estilo ou tipo)", key="grid_busca")
+    with colf2:
+        marca_f = st.selectbox("Marca", ["Todas"] + get_distinct_values("marca"), key="grid_marca")
+    with colf3:
+        tipo_f = st.selectbox("Tipo", ["Todos"] + get_distinct_values("tipo"), key="grid_tipo")
+    colf4, colf5 = st.columns([2, 1])
+    with colf4:
+        modo = st.radio("Exibição", ["Tabela", "Cartões"], horizontal=True, key="grid_modo")
+    with colf5:
+        por_pagina = st.selectbox("Itens por página", POR_PAGINA, key="grid_por_pagina")
+
+    filtros = {
+        "busca": busca,
+        "marca": marca_f if marca_f != "Todas" else None,
+        "tipo": tipo_f if tipo_f != "Todos" else None,
+    }
+    resumo = get_produtos_summary(filtros)
+    colm1, colm2 = st.columns(2)
+    colm1.metric("Produtos", resumo["total"])
+    colm2.metric("Valor Total em Estoque", format_to_brl(get_inventory_valuation()["valor"]))
+    if resumo["total"] == 0:
+        st.info("Nenhum produto encontrado." if busca else "Nenhum produto cadastrado.")
+        return
+
+    total_paginas = max((resumo["total"] + por_pagina - 1) // por_pagina, 1)
+    pagina = st.number_input("Página", min_value=1, max_value=total_paginas,
+                             value=1, step=1, key="grid_pagina")
+    st.caption(f"Página {pagina} de {total_paginas}")
+    produtos = query_produtos(filtros, limit=por_pagina, offset=(pagina - 1) * por_pagina)
+
+    expiry_panel()
+    bulk_actions(filtros, resumo["total"])
+    if modo == "Tabela":
+        products_table(produtos, f"{busca}_{marca_f}_{tipo_f}_{por_pagina}_{pagina}")
+    else:
+        products_cards(produtos)
+
+def expiry_panel():
+    # Vencidos são contados à parte: listados junto, os mais antigos
+    # ocupariam o limite e esconderiam os que ainda vão vencer
+    vencendo = get_expiring_produtos(30, limit=100, include_expired=False)
+    vencidos = count_expired_produtos()
+    qtd = f"{len(vencendo)}+" if len(vencendo) == 100 else len(vencendo)
+    titulo = f"⏰ Validade: {qtd} produto(s) vencem em até 30 dias"
+    if vencidos:
+        titulo += f" ({vencidos} já vencidos)"
+    with st.expander(titulo):
+        if vencidos:
+            st.error(f"{vencidos} produto(s) com validade vencida.")
+        if not vencendo:
+            st.caption("Nenhum produto em estoque vence nos próximos 30 dias.")
+            return
+        st.dataframe(
+            [{"ID": p["id"], "Produto": p["nome"], "Marca": p.get("marca") or "-",
+              "Qtd": safe_int(p["quantidade"]), "Validade": format_date(p["data_validade"]),
+              "Dias": p["dias_restantes"]} for p in vencendo],
+            hide_index=True, use_container_width=True,
+        )
+
+def bulk_actions(filtros, total):
+    with st.expander(f"⚙️ Ações em lote ({total} produtos do filtro atual)"):
+        colp1, colp2, colp3 = st.columns([1, 1, 1], vertical_alignment="bottom")
+        with colp1:
+            tipo_reajuste = st.radio("Reajuste de preço", ["Percentual (%)", "Valor (R$)"],
+                                     horizontal=True, key="lote_tipo_reajuste")
+        with colp2:
+            reajuste = st.number_input("Reajuste", value=0.0, step=1.0, format="%.2f",
+                                       key="lote_reajuste", help="Use valores negativos para reduzir")
+        with colp3:
+            if st.button("Aplicar reajuste", disabled=reajuste == 0):
+                try:
+                    if tipo_reajuste == "Percentual (%)":
+                        n = bulk_update_prices(filtros, pct=reajuste)
+                    else:
+                        n = bulk_update_prices(filtros, valor=reajuste)
+                    st.toast(f"Preço reajustado em {n} produtos.")
+                    st.rerun(scope="fragment")
+                except Exception as e:
+                    st.error(f"Erro no reajuste: {e}")
+
+        colr1, colr2 = st.columns([2, 1], vertical_alignment="bottom")
+        with colr1:
+            repor = st.number_input("Repor unidades em cada produto", min_value=0, step=1,
+                                    key="lote_repor")
+        with colr2:
+            if st.button("Aplicar reposição", disabled=repor == 0):
+                try:
+                    n = bulk_restock_by_filter(filtros, repor)
+                    st.toast(f"{n} produtos repostos.")
+                    st.rerun(scope="fragment")
+                except Exception as e:
+                    st.error(f"Erro na reposição: {e}")
+
+        if st.session_state["role"] == "admin":
+            bulk_delete_panel(filtros)
+
+def bulk_delete_panel(filtros):
+    # Os ids são lidos no momento da confirmação e são exatamente esses que
+    # saem: produtos que passem a atender ao filtro depois disso ficam.
+    confirmar = st.checkbox("Confirmo a exclusão dos produtos do filtro",
+                            key=f"lote_confirma_{st.session_state['grid_versao']}")
+    chave = repr(sorted(filtros.items()))
+    confirmados = st.session_state.get("lote_exclusao")
+    if not confirmar:
+        st.session_state.pop("lote_exclusao", None)
+        ids = []
+    elif confirmados and confirmados[0] == chave:
+        ids = confirmados[1]
+    else:
+        try:
+            ids = get_produto_ids(filtros)
+        except ValueError as e:
+            st.error(f"Exclusão em lote indisponível: {e}")
+            ids = []
+        st.session_state["lote_exclusao"] = (chave, ids)
+    if st.button(f"Excluir {len(ids)} produtos" if confirmar else "Excluir produtos do filtro",
+                 disabled=not ids, key="lote_excluir"):
+        try:
+            n = bulk_delete(ids)
+            st.session_state["grid_versao"] += 1
+            st.session_state.pop("lote_exclusao", None)
+            st.toast(f"{n} produtos excluídos.")
+            st.rerun(scope="fragment")
+        except Exception as e:
+            st.error(f"Erro ao excluir: {e}")
+
+def products_table(produtos, pagina_key):
+    admin = st.session_state["role"] == "admin"
+    # A chave muda com a página e após cada aplicação, descartando edições pendentes
+    editor_key = f"grid_editor_{pagina_key}_{st.session_state['grid_versao']}"
+    # edited_rows é indexado pela posição da linha. Enquanto houver edições
+    # pendentes a tabela mostra as linhas da primeira exibição, e é por elas
+    # (pelo id) que as edições são aplicadas, mesmo que outro caixa tenha
+    # incluído, renomeado ou excluído produtos nesse meio-tempo.
+    edicoes = st.session_state.get(editor_key, {}).get("edited_rows", {})
+    exibidas = st.session_state.get("grid_exibidas")
+    if edicoes and exibidas and exibidas[0] == editor_key:
+        linhas = exibidas[1]
+    else:
+        linhas = [{
+            "id": p["id"],
+            "nome": p["nome"],
+            "marca": p.get("marca"),
+            "tipo": p.get("tipo"),
+            "preco": safe_float(p["preco"]),
+            "quantidade": safe_int(p["quantidade"]),
+            "validade": p.get("data_validade") or "",
+            "vender": 0,
+            "repor": 0,
+            "excluir": False,
+        } for p in produtos]
+        st.session_state["grid_exibidas"] = (editor_key, linhas)
+    colunas = ["id", "nome", "marca", "tipo", "preco", "quantidade", "validade", "vender", "repor"]
+    if admin:
+        colunas.append("excluir")
+    st.data_editor(
+        linhas,
+        key=editor_key,
+        column_order=colunas,
+        disabled=["id", "marca", "tipo", "validade"],
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "id": st.column_config.NumberColumn("ID", format="%d"),
+            "nome": st.column_config.TextColumn("Nome", required=True, max_chars=150),
+            "marca": "Marca",
+            "tipo": "Tipo",
+            "preco": st.column_config.NumberColumn("Preço (R$)", min_value=0.0, format="%.2f"),
+            "quantidade": st.column_config.NumberColumn("Qtd", min_value=0, step=1),
+            "validade": "Validade",
+            "vender": st.column_config.NumberColumn("Vender", min_value=0, step=1,
+                                                    help="Unidades a vender"),
+            "repor": st.column_config.NumberColumn("Repor", min_value=0, step=1,
+                                                   help="Unidades a somar ao estoque"),
+            "excluir": st.column_config.CheckboxColumn("Excluir"),
+        },
+    )
+    edicoes = st.session_state.get(editor_key, {}).get("edited_rows", {})
+    if st.button("Aplicar alterações", disabled=not edicoes, type="primary"):
+        apply_table_edits(linhas, produtos, edicoes)
+
+    cole1, cole2 = st.columns([3, 1], vertical_alignment="bottom")
+    with cole1:
+        editar_id = st.selectbox(
+            "Edição completa (foto, marca, estilo, tipo)", [p["id"] for p in produtos],
+            format_func=lambda pid: next(f"{p['nome']} (ID {pid})" for p in produtos if p["id"] == pid),
+        )
+    if cole2.button("Editar"):
+        st.session_state["edit_product_id"] = editar_id
+        st.session_state["edit_mode"] = True
+        st.rerun()
+
+def apply_table_edits(linhas, produtos, edicoes):
+    """
+    Grava só as linhas alteradas, tudo numa única transação. Cada edição é
+    ligada ao produto pelo id da linha exibida; produtos que saíram da
+    página desde então são ignorados.
+    """
+    atuais = {p["id"]: p for p in produtos}
+    edicoes_prod, reposicoes, vendas, exclusoes, ignoradas = [], [], [], [], 0
+    for pos, mudancas in edicoes.items():
+        linha = linhas[int(pos)]
+        p = atuais.get(linha["id"])
+        if not p:
+            ignoradas += 1
+            continue
+        if mudancas.get("excluir"):
+            exclusoes.append(p["id"])
+            continue
+        campos = {k: mudancas[k] for k in ("nome", "preco", "quantidade") if k in mudancas}
+        if campos:
+            # Quantidade que o usuário viu: vendas feitas depois disso são preservadas
+            edicoes_prod.append((p["id"], campos, linha["quantidade"]))
+        if safe_int(mudancas.get("repor")) > 0:
+            reposicoes.append((p["id"], safe_int(mudancas["repor"])))
+        if safe_int(mudancas.get("vender")) > 0:
+            vendas.append((p["id"], safe_int(mudancas["vender"])))
+    if st.session_state["role"] != "admin":
+        exclusoes = []
+    try:
+        res = apply_produto_changes(edicoes_prod, reposicoes, vendas, exclusoes,
+                                    usuario=st.session_state.get("username"))
+    except Exception as e:
+        st.error(f"Erro ao aplicar alterações (nada foi gravado): {e}")
+        return
+    st.session_state["grid_versao"] += 1
+    aviso = f", {ignoradas} ignorados (saíram da página)" if ignoradas else ""
+    st.toast(f"{res['alterados']} alterados, {res['repostos']} repostos, {res['vendidos']} vendidos, "
+             f"{res['excluidos']} excluídos{aviso}.")
+    st.rerun(scope="fragment")
+
+def products_cards(produtos):
     for p in produtos:
         pid = p["id"]
         preco = safe_float(p["preco"])
         qtd = safe_int(p["quantidade"])
         subtotal = preco * qtd
-        total += subtotal
         with st.container(border=True):
             col1, col2, col3 = st.columns([1, 3, 1])
             with col1:
-                if p.get("foto"):
-                    path = os.path.join(ASSETS_DIR, p["foto"])
-                    if os.path.exists(path):
-                        st.image(path, use_container_width=True)
-                    else:
-                        st.caption("Sem foto")
+                thumb = get_thumbnail(p.get("foto"))
+                if thumb:
+                    st.image(thumb, use_container_width=True)
                 else:
                     st.caption("Sem foto")
             with col2:
@@ -184,8 +530,8 @@ def manage_products_list_actions():
                 if qtd > 0:
                     if st.button("Vender 1", key=f"sell_{pid}"):
                         try:
-                            mark_produto_as_sold(pid, 1)
-                            st.rerun()
+                            mark_produto_as_sold(pid, 1, usuario=st.session_state.get("username"))
+                            st.rerun(scope="fragment")
                         except Exception as e:
                             st.error(f"Erro na venda: {e}")
                 if st.button("Editar", key=f"edit_{pid}"):
@@ -196,16 +542,20 @@ def manage_products_list_actions():
                     if st.button("Excluir", key=f"del_{pid}"):
                         try:
                             delete_produto(pid)
-                            st.rerun()
+                            st.rerun(scope="fragment")
                         except Exception as e:
                             st.error(f"Erro ao excluir: {e}")
-    st.sidebar.metric("Valor Total em Estoque", format_to_brl(total))
 
+rerun = instrumentacao.pagina("Gerenciar Produtos")
 if st.session_state["edit_mode"]:
+    rerun.secao("edição")
     show_edit_form()
 else:
     menu = st.sidebar.radio("Navegação", ["Listar e Ações", "Cadastrar Novo"])
     if menu == "Cadastrar Novo":
+        rerun.secao("cadastro")
         add_product_form()
     else:
+        rerun.secao("lista")
         manage_products_list_actions()
+rerun.fim()
@@ -2,11 +2,13 @@ import streamlit as st
 import os
 from datetime import datetime
 from utils.database import (
-    get_all_produtos,
-    ASSETS_DIR,
+    get_sales_summary,
     safe_int,
     safe_float
 )
+from utils.reposicao import get_reorder_list
+from utils.thumbnails import get_thumbnail
+from utils import instrumentacao
 
 # =========================
 # CONFIGURAÇÃO DA PÁGINA
@@ -16,6 +18,7 @@ st.set_page_config(
     page_icon="💰",
     layout="wide"
 )
+rerun = instrumentacao.pagina("Produtos Vendidos")
 
 # =========================
 # FUNÇÕES AUXILIARES
@@ -46,84 +49,122 @@ load_css("style.css")
 # =========================
 st.title("💰 Histórico de Produtos Vendidos")
 st.markdown("---")
-st.info("Lista de produtos que já tiveram vendas, com quantidade vendida calculada automaticamente.")
+st.info("Lista de produtos que já tiveram vendas, calculada a partir do registro de cada venda.")
+
+# =========================
+# REPOSIÇÃO
+# =========================
+rerun.secao("reposição")
+reposicao = get_reorder_list()
+n_repor = sum(len(itens) for itens in reposicao.values())
+with st.expander(f"🔁 Reposição sugerida ({n_repor} produtos)"):
+    st.caption("Velocidade = média móvel exponencial das vendas diárias (unidades/dia). "
+               "Entram na lista os produtos com estoque no ponto de reposição "
+               "(prazo de entrega + estoque de segurança).")
+    if not reposicao:
+        st.success("Nenhum produto precisa de reposição.")
+    for marca, itens in reposicao.items():
+        st.markdown(f"**{marca or 'Sem marca'}**")
+        st.dataframe(
+            [{"Produto": i["nome"], "Estoque": i["quantidade"],
+              "Vendas/dia": i["velocidade"], "Dias de cobertura": i["dias_cobertura"],
+              "Ponto de reposição": i["ponto_reposicao"], "Comprar": i["sugestao"]}
+             for i in itens],
+            hide_index=True, use_container_width=True,
+        )
 
 # =========================
 # DADOS
 # =========================
-todos = get_all_produtos(include_sold=True)
-
-# Produtos que já tiveram venda
-vendidos = [p for p in todos if p.get("data_ultima_venda")]
-
-if not vendidos:
-    st.success("Nenhum produto vendido até o momento.")
+rerun.secao("resumo")
+POR_PAGINA = 30
+PERIODOS = {
+    "30d": "Últimos 30 dias",
+    "7d": "Últimos 7 dias",
+    "hoje": "Hoje",
+    "90d": "Últimos 90 dias",
+    "365d": "Últimos 12 meses",
+    "tudo": "Todo o período",
+}
+
+periodo = st.selectbox("Período", list(PERIODOS), format_func=PERIODOS.get)
+totais = get_sales_summary(periodo)
+
+if totais["unidades"] == 0:
+    st.success("Nenhum produto vendido neste período.")
+    rerun.fim()
     st.stop()
 
 # =========================
 # MÉTRICAS
 # =========================
-total_produtos_vendidos = len(vendidos)
-total_unidades_vendidas = 0
-faturamento_estimado = 0.0
-
-for p in vendidos:
-    qtd_inicial = safe_int(p.get("quantidade_inicial", 0))
-    qtd_atual = safe_int(p.get("quantidade", 0))
-    qtd_vendida = max(qtd_inicial - qtd_atual, 0)
-
-    total_unidades_vendidas += qtd_vendida
-    faturamento_estimado += qtd_vendida * safe_float(p.get("preco", 0))
-
+rerun.secao("métricas e gráficos")
 col1, col2, col3 = st.columns(3)
 with col1:
-    st.metric("Produtos vendidos", total_produtos_vendidos)
+    st.metric("Produtos vendidos", totais["produtos"])
 with col2:
-    st.metric("Unidades vendidas", total_unidades_vendidas)
+    st.metric("Unidades vendidas", totais["unidades"])
 with col3:
-    st.metric("Faturamento estimado", format_to_brl(faturamento_estimado))
+    st.metric("Faturamento", format_to_brl(totais["faturamento"]))
+
+por_dia = get_sales_summary(periodo, "dia")
+por_marca = get_sales_summary(periodo, "marca")
+colg1, colg2 = st.columns([2, 1])
+with colg1:
+    st.caption("Faturamento por dia")
+    st.bar_chart({d["dia"]: d["faturamento"] for d in por_dia})
+with colg2:
+    st.caption("Por marca")
+    st.dataframe(
+        [{"Marca": m["marca"] or "-", "Unidades": m["unidades"],
+          "Faturamento": format_to_brl(m["faturamento"])} for m in por_marca],
+        hide_index=True,
+    )
 
 st.markdown("---")
 
 # =========================
 # LISTAGEM DOS PRODUTOS
 # =========================
+rerun.secao("listagem")
+total_paginas = max((totais["produtos"] + POR_PAGINA - 1) // POR_PAGINA, 1)
+pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1)
+st.caption(f"Página {pagina} de {total_paginas} • mais vendidos primeiro")
+
+vendidos = get_sales_summary(periodo, "produto", limit=POR_PAGINA, offset=(pagina - 1) * POR_PAGINA)
+
 for p in vendidos:
-    qtd_inicial = safe_int(p.get("quantidade_inicial", 0))
     qtd_atual = safe_int(p.get("quantidade", 0))
-    qtd_vendida = max(qtd_inicial - qtd_atual, 0)
+    qtd_vendida = safe_int(p.get("unidades", 0))
 
     with st.container(border=True):
         col_info, col_img = st.columns([3, 1])
 
         with col_info:
-            st.markdown(f"### {p.get('nome', 'N/A')}")
-            st.write(f"💲 **Preço unitário:** {format_to_brl(p.get('preco', 0))}")
+            nome = p.get("nome") or f"Produto removido (ID {p.get('produto_id')})"
+            st.markdown(f"### {nome}")
+            st.write(f"💲 **Preço unitário atual:** {format_to_brl(p.get('preco') or 0)}")
 
             st.write(
                 f"""
-                📦 **Quantidade inicial:** {qtd_inicial}  
                 📉 **Quantidade atual:** {qtd_atual}  
-                ✅ **Quantidade vendida:** **{qtd_vendida}**
+                ✅ **Quantidade vendida:** **{qtd_vendida}**  
+                💰 **Faturamento:** {format_to_brl(p.get('faturamento', 0))}
                 """
             )
 
             st.caption(
-                f"Marca: {p.get('marca', 'N/A')} • "
-                f"Tipo: {p.get('tipo', 'N/A')}"
+                f"Marca: {p.get('marca') or 'N/A'} • "
+                f"Tipo: {p.get('tipo') or 'N/A'}"
             )
 
-            if p.get("data_ultima_venda"):
-                st.caption(f"🕒 Última venda: {p['data_ultima_venda']}")
+            if p.get("ultimo_dia"):
+                st.caption(f"🕒 Última venda: {p['ultimo_dia']}")
 
         with col_img:
-            foto = p.get("foto")
-            if foto:
-                path = os.path.join(ASSETS_DIR, foto)
-                if os.path.exists(path):
-                    st.image(path, use_container_width=True)
-                else:
-                    st.caption("Sem foto")
+            thumb = get_thumbnail(p.get("foto"), size=480)
+            if thumb:
+                st.image(thumb, use_container_width=True)
             else:
                 st.caption("Sem foto")
 
@@ -132,3 +173,4 @@ for p in vendidos:
 # =========================
 st.markdown("---")
 st.caption(f"Atualizado em {datetime.now().strftime('%d/%m/%Y %H:%M')}")
+rerun.fim()
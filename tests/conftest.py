@@ -0,0 +1,37 @@
+# tests/conftest.py
+
+import logging
+
+import pytest
+
+from utils import database as db
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """utils.database apontado para um banco (e pasta de fotos) temporário."""
+    db.close_all_connections()
+    db.invalidate_produtos_cache()
+    db.invalidate_users_cache()
+    monkeypatch.setattr(db, "DATABASE", str(tmp_path / "estoque.db"))
+    monkeypatch.setattr(db, "ASSETS_DIR", str(tmp_path / "assets"))
+    db.init_db()
+    yield db
+    db.close_all_connections()
+    db.invalidate_produtos_cache()
+    db.invalidate_users_cache()
+
+
+@pytest.fixture
+def pagina(banco):
+    """Abre uma página com AppTest já logada como admin."""
+    from streamlit.testing.v1 import AppTest
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    def abre(caminho):
+        at = AppTest.from_file(caminho, default_timeout=30)
+        at.session_state["session_token"] = banco.create_session(banco.get_user("admin"))
+        return at
+
+    return abre
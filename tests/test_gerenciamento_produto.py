@@ -0,0 +1,29 @@
+# tests/test_gerenciamento_produto.py
+
+import os
+
+PAGINA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      "pages", "gerenciamento_produto.py")
+
+
+def test_edicao_nao_desfaz_venda_feita_com_formulario_aberto(banco, pagina):
+    pid = banco.add_produto("Perfume", 50.0, 7, banco.MARCAS[0], banco.ESTILOS[0], banco.TIPOS[0])
+    at = pagina(PAGINA)
+    at.session_state["edit_mode"] = True
+    at.session_state["edit_product_id"] = pid
+    at.run()
+    campo = at.number_input(key=f"edit_qtd_{pid}")
+    assert campo.value == 7
+
+    # Outro caixa vende 2 com o formulário aberto; um rerun no meio não
+    # troca o widget (o que apagaria o valor digitado no navegador)
+    banco.mark_produto_as_sold(pid, 2)
+    at.run()
+    assert at.number_input(key=f"edit_qtd_{pid}").id == campo.id
+    assert at.number_input(key=f"edit_qtd_{pid}").value == 7
+
+    at.number_input(key=f"edit_qtd_{pid}").set_value(20)
+    next(b for b in at.button if b.label == "Salvar Alterações").click().run()
+    assert not at.exception
+    # 20 digitados sobre os 7 exibidos = +13, aplicados aos 5 que restaram
+    assert banco.get_produto_by_id(pid)["quantidade"] == 18
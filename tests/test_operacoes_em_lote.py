@@ -0,0 +1,35 @@
+# tests/test_operacoes_em_lote.py
+
+import pytest
+
+
+def _produtos(banco, n, marca=None):
+    return [banco.add_produto(f"Produto {i}", 10.0, 5, marca or banco.MARCAS[0],
+                              banco.ESTILOS[0], banco.TIPOS[0]) for i in range(n)]
+
+
+def test_bulk_restock_e_bulk_delete_por_id(banco):
+    ids = _produtos(banco, 3)
+    assert banco.bulk_restock([(ids[0], 2), (ids[1], 3), (999, 1)]) == 2
+    assert [banco.get_produto_by_id(i)["quantidade"] for i in ids] == [7, 8, 5]
+
+    assert banco.bulk_delete([ids[0], ids[2], 999]) == 2
+    assert [p["id"] for p in banco.get_all_produtos()] == [ids[1]]
+    assert banco.bulk_delete([]) == 0
+
+
+@pytest.mark.parametrize("filtros", [None, {}, {"busca": "", "marca": None}, {"busca": "!!"}])
+def test_operacoes_por_filtro_recusam_filtro_vazio_ou_invalido(banco, filtros):
+    _produtos(banco, 2)
+    with pytest.raises(ValueError):
+        banco.get_produto_ids(filtros)
+    with pytest.raises(ValueError):
+        banco.bulk_restock_by_filter(filtros, 1)
+    assert all(p["quantidade"] == 5 for p in banco.get_all_produtos())
+
+
+def test_bulk_restock_by_filter(banco):
+    _produtos(banco, 2, marca=banco.MARCAS[0])
+    outro = _produtos(banco, 1, marca=banco.MARCAS[1])[0]
+    assert banco.bulk_restock_by_filter({"marca": banco.MARCAS[0]}, 4) == 2
+    assert banco.get_produto_by_id(outro)["quantidade"] == 5
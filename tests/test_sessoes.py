@@ -0,0 +1,18 @@
+# tests/test_sessoes.py
+
+
+def test_segredo_das_sessoes_fica_em_segredos_como_texto(banco):
+    conn = banco.get_db_connection()
+    try:
+        assert conn.execute(
+            "SELECT typeof(valor) FROM segredos WHERE nome = 'session_secret'"
+        ).fetchone()[0] == "text"
+        assert not conn.execute(
+            "SELECT 1 FROM app_meta WHERE chave = 'session_secret'"
+        ).fetchone()
+    finally:
+        banco.release_db_connection(conn)
+
+    token = banco.create_session(banco.get_user("admin"))
+    assert banco.get_session(token)["username"] == "admin"
+    assert banco.get_session(token[:-1] + ("0" if token[-1] != "0" else "1")) is None
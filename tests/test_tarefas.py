@@ -0,0 +1,20 @@
+# tests/test_tarefas.py
+
+from utils import tarefas
+
+
+def test_tarefa_presa_de_processo_anterior_aparece_como_erro(banco):
+    conn = banco.get_db_connection()
+    try:
+        conn.execute(
+            "INSERT INTO tarefas (tipo, chave, params, pid, status, criada_em, iniciada_em) "
+            "VALUES ('exportacao', 'x', '{}', -1, ?, ?, ?)",
+            (tarefas.EXECUTANDO, tarefas._agora(), tarefas._agora())
+        )
+        conn.commit()
+    finally:
+        banco.release_db_connection(conn)
+
+    [tarefa] = tarefas.list_tarefas()
+    assert tarefa["status"] == tarefas.ERRO
+    assert "reiniciado" in tarefa["erro"]
@@ -0,0 +1,41 @@
+# utils/autenticacao.py
+
+import streamlit as st
+
+from utils.database import create_session, get_session, delete_session
+
+# Chaves de st.session_state usadas pelas páginas
+_ANONIMO = {"logged_in": False, "username": None, "role": "guest"}
+
+
+def _aplica(logged_in, username, role):
+    st.session_state["logged_in"] = logged_in
+    st.session_state["username"] = username
+    st.session_state["role"] = role
+
+
+def start_session(user):
+    """Depois de check_user_login: abre a sessão e marca o usuário como logado."""
+    st.session_state["session_token"] = create_session(user)
+    _aplica(True, user["username"], user["role"])
+
+
+def end_session():
+    delete_session(st.session_state.pop("session_token", None))
+    _aplica(**_ANONIMO)
+
+
+def sync_session():
+    """
+    Chamada no topo das páginas que exigem login. Revalida o token (em
+    memória, sem consultar users) e atualiza logged_in/username/role: uma
+    sessão expirada, encerrada ou de usuário removido volta a anônimo, e
+    uma troca de papel vale no próximo rerun.
+    """
+    sessao = get_session(st.session_state.get("session_token"))
+    if sessao:
+        _aplica(True, sessao["username"], sessao["role"])
+    else:
+        st.session_state.pop("session_token", None)
+        _aplica(**_ANONIMO)
+    return sessao
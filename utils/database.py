@@ -3,20 +3,23 @@
 import sqlite3
 import os
 import hashlib
-import csv
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm
-from datetime import datetime
+import threading
+import time
+import re
+import types
+from datetime import datetime, date, timedelta
 import io
+from collections import OrderedDict
+
+from utils.instrumentacao import instrumentar, registra_conexao
 
 # Diretórios
 DATABASE_DIR = "data"
 DATABASE = os.path.join(DATABASE_DIR, "estoque.db")
 ASSETS_DIR = "assets"
 
-os.makedirs(DATABASE_DIR, exist_ok=True)
-os.makedirs(ASSETS_DIR, exist_ok=True)
+# Importar este módulo não cria diretórios nem abre o banco: isso fica para
+# init_db(), chamada automaticamente na primeira conexão.
 
 # Listas básicas (você pode expandir)
 MARCAS = [
@@ -46,18 +49,462 @@ def safe_float(value, default=0.0):
     except Exception:
         return default
 
+_DATA_ISO = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})")
+_DATA_BR = re.compile(r"^(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})$")
+
+def normalize_date(value):
+    """
+    Converte uma data (date, "AAAA-MM-DD[...]" ou "DD/MM/AAAA") para o
+    formato "AAAA-MM-DD" guardado no banco. Vazio vira None; data inválida
+    levanta ValueError.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    texto = str(value).strip()
+    if not texto:
+        return None
+    m = _DATA_ISO.match(texto)
+    if m:
+        ano, mes, dia = m.groups()
+    else:
+        m = _DATA_BR.match(texto)
+        if not m:
+            raise ValueError(f"data inválida: {value!r}")
+        dia, mes, ano = m.groups()
+    try:
+        return date(int(ano), int(mes), int(dia)).isoformat()
+    except ValueError:
+        raise ValueError(f"data inválida: {value!r}")
+
+# ---------- CONEXÕES ----------
+
+# Ajustes aplicados a cada conexão nova do pool. WAL permite que leitores e
+# escritores trabalhem ao mesmo tempo; NORMAL é seguro em WAL e evita um fsync
+# por commit.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",        # ~16 MB de cache de páginas
+    "PRAGMA mmap_size=134217728",      # 128 MB mapeados em memória
+)
+POOL_MAX_IDLE = 8
+BUSY_TIMEOUT_S = 10.0
+CACHED_STATEMENTS = 256
+
+
+class ConnectionPool:
+    """
+    Pool de conexões SQLite compartilhado entre as threads do Streamlit.
+
+    Cada rerun roda numa thread nova, então conexões por thread seriam
+    descartadas a cada interação. Aqui as conexões ficam numa pilha e são
+    emprestadas para uma thread de cada vez (check_same_thread=False).
+    """
+
+    def __init__(self, path, max_idle=POOL_MAX_IDLE):
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_S,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        inicio = time.perf_counter()
+        with self._lock:
+            if self._pid != os.getpid():
+                # Processo filho (fork): conexões herdadas não podem ser usadas
+                self._idle = []
+                self._pid = os.getpid()
+            conn = self._idle.pop() if self._idle else None
+        nova = conn is None
+        if nova:
+            conn = self._connect()
+        registra_conexao((time.perf_counter() - inicio) * 1000, nova)
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool():
+    # Indexado pelo caminho para respeitar alterações de DATABASE (ex.: testes)
+    with _pools_lock:
+        pool = _pools.get(DATABASE)
+        if pool is None:
+            pool = _pools[DATABASE] = ConnectionPool(DATABASE)
+        return pool
+
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Empresta uma conexão do pool. Devolva com release_db_connection()."""
+    if DATABASE not in _schema_ok:
+        init_db()
+    return _get_pool().acquire()
+
+def release_db_connection(conn):
+    _get_pool().release(conn)
+
+def close_all_connections():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
+
+# ---------- CACHE DE LEITURA ----------
+
+PRODUTOS_CACHE_SIZE = 256
+PRODUTOS_CACHE_TTL_S = 300.0
+USERS_CACHE_SIZE = 128
+USERS_CACHE_TTL_S = 60.0
+SESSIONS_CACHE_SIZE = 1024
+SESSIONS_CACHE_TTL_S = 300.0
+
+
+class ReadCache:
+    """
+    Cache LRU com validade (TTL) compartilhado por todas as sessões do
+    processo. As funções de escrita invalidam as entradas afetadas logo após
+    o commit; o TTL só limita o quanto uma escrita feita por outro processo
+    pode demorar a aparecer.
+
+    Os valores guardados são devolvidos sem cópia: quem chama não deve
+    alterá-los.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Incrementada a cada invalidação: um resultado lido antes dela não
+        # é guardado, mesmo que a leitura termine depois.
+        self._geracao = 0
+
+    def get_or_load(self, key, loader):
+        key = (DATABASE,) + key
+        agora = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > agora:
+                self._data.move_to_end(key)
+                return item[1]
+            geracao = self._geracao
+        valor = loader()
+        with self._lock:
+            if geracao == self._geracao:
+                self._data[key] = (agora + self.ttl, valor)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return valor
+
+    def invalidate(self, predicate=None):
+        """Remove as entradas cuja chave (sem o banco) satisfaz predicate; sem predicate, todas."""
+        with self._lock:
+            self._geracao += 1
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if predicate(k[1:])]:
+                del self._data[key]
+
+
+_produtos_cache = ReadCache(PRODUTOS_CACHE_SIZE, PRODUTOS_CACHE_TTL_S)
+_users_cache = ReadCache(USERS_CACHE_SIZE, USERS_CACHE_TTL_S)
+_sessions_cache = ReadCache(SESSIONS_CACHE_SIZE, SESSIONS_CACHE_TTL_S)
+
+def invalidate_produtos_cache(ids=None):
+    """
+    Descarta as leituras de produtos afetadas por uma escrita. Com ids, só
+    as fichas individuais desses produtos saem do cache (listas, buscas e
+    agregados sempre saem); sem ids, tudo é descartado.
+    """
+    if ids is None:
+        _produtos_cache.invalidate()
+        return
+    ids = {safe_int(i) for i in ids}
+    _produtos_cache.invalidate(lambda k: k[0] != "id" or k[1] in ids)
+
+def invalidate_users_cache():
+    _users_cache.invalidate()
+    _sessions_cache.invalidate()
+
+# Senhas: PBKDF2-HMAC-SHA256 com sal próprio, guardadas como
+# "pbkdf2_sha256$iterações$sal$hash". Cada verificação é cara de propósito,
+# por isso roda só no login; os reruns seguintes usam a sessão (SESSÕES).
+PASSWORD_ALGORITHM = "pbkdf2_sha256"
+PASSWORD_ITERATIONS = 240000
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
 
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    import secrets
 
-def create_tables():
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), PASSWORD_ITERATIONS)
+    return f"{PASSWORD_ALGORITHM}${PASSWORD_ITERATIONS}${salt}${digest.hex()}"
+
+def verify_password(password: str, stored: str):
+    """
+    Confere a senha com o hash guardado. Retorna (confere, precisa_rehash):
+    precisa_rehash indica hash antigo (SHA-256 sem sal ou menos iterações).
+    """
+    import hmac
+
+    stored = stored or ""
+    if _LEGACY_SHA256.match(stored):
+        digest = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, stored), True
+    try:
+        algoritmo, iteracoes, salt, esperado = stored.split("$")
+        iteracoes = int(iteracoes)
+    except ValueError:
+        return False, False
+    if algoritmo != PASSWORD_ALGORITHM:
+        return False, False
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), iteracoes)
+    return hmac.compare_digest(digest.hex(), esperado), iteracoes < PASSWORD_ITERATIONS
+
+# Triggers que mantêm produtos_fts em dia com produtos
+FTS_TRIGGERS = {
+    "produtos_fts_ai": """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_ai AFTER INSERT ON produtos BEGIN
+        INSERT INTO produtos_fts (rowid, nome, marca, estilo, tipo)
+        VALUES (new.id, new.nome, new.marca, new.estilo, new.tipo);
+    END;
+    """,
+    "produtos_fts_ad": """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_ad AFTER DELETE ON produtos BEGIN
+        INSERT INTO produtos_fts (produtos_fts, rowid, nome, marca, estilo, tipo)
+        VALUES ('delete', old.id, old.nome, old.marca, old.estilo, old.tipo);
+    END;
+    """,
+    "produtos_fts_au": """
+    CREATE TRIGGER IF NOT EXISTS produtos_fts_au AFTER UPDATE OF nome, marca, estilo, tipo ON produtos BEGIN
+        INSERT INTO produtos_fts (produtos_fts, rowid, nome, marca, estilo, tipo)
+        VALUES ('delete', old.id, old.nome, old.marca, old.estilo, old.tipo);
+        INSERT INTO produtos_fts (rowid, nome, marca, estilo, tipo)
+        VALUES (new.id, new.nome, new.marca, new.estilo, new.tipo);
+    END;
+    """,
+}
+
+def _suspend_fts_sync(cursor):
+    """
+    Para cargas grandes: remove os triggers do FTS dentro da transação atual.
+    Como DDL é transacional no SQLite, outras conexões nunca veem o banco
+    sem os triggers. Termine sempre com _resume_fts_sync().
+    """
+    for nome in FTS_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {nome}")
+
+def _resume_fts_sync(cursor):
+    cursor.execute("INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')")
+    for ddl in FTS_TRIGGERS.values():
+        cursor.execute(ddl)
+
+# ---------- FOTOS ----------
+
+# Uploads gravados antes do armazenamento por conteúdo: "<timestamp>_<nome>"
+_LEGACY_UPLOAD_RE = re.compile(r"^\d+_.+")
+
+def _hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+def _foto_name(digest, original_name):
+    ext = os.path.splitext(original_name or "")[1].lower()
+    return f"{digest}{ext}"
+
+# Uma foto recém-gravada ainda não tem produto (refs = 0) até o formulário
+# salvar o produto; nesse intervalo ela não é tratada como órfã. Passado o
+# prazo sem referência (upload abandonado), é apagada.
+FOTO_CARENCIA = timedelta(hours=1)
+
+def save_foto(data, original_name):
+    """
+    Grava uma foto em ASSETS_DIR com nome derivado do conteúdo (sha256 +
+    extensão) e retorna esse nome. A mesma imagem enviada duas vezes é
+    armazenada uma vez só; as referências são contadas na tabela fotos
+    pelos triggers de produtos. criado_em marca o início da carência
+    (FOTO_CARENCIA) em que a foto sem referência não é apagada.
+    """
+    data = bytes(data)
+    nome = _foto_name(_hash_bytes(data), original_name)
+    path = os.path.join(ASSETS_DIR, nome)
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        # O lock de escrita serializa com _drop_orphan_fotos
+        conn.execute("BEGIN IMMEDIATE")
+        agora = datetime.now()
+        _purge_abandoned_fotos(conn.cursor(), agora)
+        conn.execute(
+            "INSERT INTO fotos (nome, refs, criado_em) VALUES (?, 0, ?) "
+            "ON CONFLICT(nome) DO UPDATE SET criado_em = excluded.criado_em",
+            (nome, agora.isoformat())
+        )
+        if not os.path.exists(path):
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        conn.commit()
+        return nome
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+# Máximo de parâmetros por cláusula IN (...) montada em Python
+SQL_IN_CHUNK = 500
+
+def _remove_fotos(cursor, nomes):
+    for nome in nomes:
+        cursor.execute("DELETE FROM fotos WHERE nome = ?", (nome,))
+        try:
+            os.remove(os.path.join(ASSETS_DIR, nome))
+        except FileNotFoundError:
+            pass
+
+def _purge_abandoned_fotos(cursor, agora=None):
+    """Apaga as fotos sem referência cuja carência já passou."""
+    limite = ((agora or datetime.now()) - FOTO_CARENCIA).isoformat()
+    abandonadas = [r[0] for r in cursor.execute(
+        "SELECT nome FROM fotos WHERE refs <= 0 AND (criado_em IS NULL OR criado_em < ?)",
+        (limite,)
+    ).fetchall()]
+    _remove_fotos(cursor, abandonadas)
+    return abandonadas
+
+def _drop_orphan_fotos(cursor, nomes):
+    """
+    Remove (registro e arquivo) as fotos da lista que não são mais usadas
+    por nenhum produto. Deve rodar dentro da transação de escrita que
+    desvinculou as fotos. Fotos ainda na carência de save_foto ficam: o
+    mesmo arquivo pode ter acabado de ser enviado para outro produto.
+    """
+    nomes = sorted(set(n for n in nomes if n))
+    if not nomes:
+        return []
+    limite = (datetime.now() - FOTO_CARENCIA).isoformat()
+    orfas, registradas = [], set()
+    for i in range(0, len(nomes), SQL_IN_CHUNK):
+        bloco = nomes[i:i + SQL_IN_CHUNK]
+        marks = ",".join("?" * len(bloco))
+        for nome, refs, criado_em in cursor.execute(
+            f"SELECT nome, refs, criado_em FROM fotos WHERE nome IN ({marks})", bloco
+        ).fetchall():
+            registradas.add(nome)
+            if refs <= 0 and (criado_em is None or criado_em < limite):
+                orfas.append(nome)
+    # Fotos antigas que nunca foram registradas: confere direto em produtos
+    for nome in nomes:
+        if nome not in registradas and not cursor.execute(
+            "SELECT 1 FROM produtos WHERE foto = ? LIMIT 1", (nome,)
+        ).fetchone():
+            orfas.append(nome)
+    _remove_fotos(cursor, orfas)
+    return orfas
 
+# Renomeações de arquivos pedidas pela migração das fotos; só são feitas
+# depois do commit de run_migrations (um rollback não deixa ASSETS_DIR
+# fora de sincronia com produtos.foto)
+_fotos_pos_migracao = []
+
+def migrate_fotos_to_content_addressed(cursor):
+    """
+    Migração única: calcula o nome por conteúdo dos uploads antigos de
+    ASSETS_DIR, atualiza produtos.foto e recalcula a contagem de
+    referências. Os arquivos em si são renomeados (e as cópias duplicadas
+    apagadas) por _apply_fotos_pos_migracao, depois do commit. Arquivos que
+    não são uploads (ex.: logo.png) ficam intactos.
+    """
+    referenciadas = {r[0] for r in cursor.execute(
+        "SELECT DISTINCT foto FROM produtos WHERE foto IS NOT NULL AND foto != ''"
+    ).fetchall()}
+    for nome in sorted(os.listdir(ASSETS_DIR)):
+        path = os.path.join(ASSETS_DIR, nome)
+        if not os.path.isfile(path):
+            continue
+        if nome not in referenciadas and not _LEGACY_UPLOAD_RE.match(nome):
+            continue
+        novo = _foto_name(_hash_file(path), nome)
+        if novo == nome:
+            continue
+        _fotos_pos_migracao.append((path, os.path.join(ASSETS_DIR, novo)))
+        if nome in referenciadas:
+            cursor.execute("UPDATE produtos SET foto = ? WHERE foto = ?", (novo, nome))
+    cursor.execute("DELETE FROM fotos")
+    cursor.execute("""
+        INSERT INTO fotos (nome, refs, criado_em)
+        SELECT foto, COUNT(*), ? FROM produtos
+        WHERE foto IS NOT NULL AND foto != ''
+        GROUP BY foto
+    """, (datetime.now().isoformat(),))
+
+def _apply_fotos_pos_migracao():
+    """
+    Chamada por run_migrations depois do commit: renomeia os uploads antigos
+    e só então apaga as cópias cujo conteúdo já existe com o nome novo.
+    """
+    duplicadas = []
+    for origem, destino in _fotos_pos_migracao:
+        if os.path.exists(destino):
+            duplicadas.append(origem)
+        else:
+            os.replace(origem, destino)
+    for origem in duplicadas:
+        try:
+            os.remove(origem)
+        except FileNotFoundError:
+            pass
+    _fotos_pos_migracao.clear()
+
+# ---------- MIGRAÇÕES ----------
+# A versão do esquema fica em PRAGMA user_version. Cada migração roda uma
+# única vez, em ordem, na mesma transação que grava o novo número; bancos
+# criados antes deste controle (versão 0) passam pela 1, que é idempotente.
+
+def _migration_1_esquema_base(cursor):
     # ---------- TABELA PRODUTOS ----------
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS produtos (
@@ -75,6 +522,166 @@ def create_tables():
     );
     """)
 
+    # Índices usados pelos filtros do estoque (query_produtos)
+    for coluna in ("marca", "estilo", "tipo", "quantidade"):
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_produtos_{coluna} ON produtos ({coluna})"
+        )
+    # Chave natural usada pela importação com upsert por (nome, marca)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_produtos_nome_marca ON produtos (nome, marca)"
+    )
+
+    # ---------- BUSCA TEXTUAL (FTS5) ----------
+    # Índice de conteúdo externo: guarda só os tokens, os textos continuam em
+    # produtos. remove_diacritics faz "fragrancia" casar com "Fragrância".
+    fts_existia = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'produtos_fts'"
+    ).fetchone()
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5(
+        nome, marca, estilo, tipo,
+        content='produtos', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+    """)
+    for ddl in FTS_TRIGGERS.values():
+        cursor.execute(ddl)
+    if not fts_existia:
+        # Bancos antigos: indexa os produtos que já existiam
+        cursor.execute("INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')")
+
+    # ---------- TABELA FOTOS ----------
+    # Contagem de referências das fotos de ASSETS_DIR, mantida por triggers.
+    # (execute em vez de executescript: executescript faria COMMIT no meio
+    # da migração.)
+    fotos_existia = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'fotos'"
+    ).fetchone()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS fotos (
+        nome TEXT PRIMARY KEY,
+        refs INTEGER NOT NULL DEFAULT 0,
+        criado_em TEXT
+    );
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS fotos_ref_ai AFTER INSERT ON produtos
+    WHEN new.foto IS NOT NULL AND new.foto != '' BEGIN
+        INSERT INTO fotos (nome, refs) VALUES (new.foto, 1)
+        ON CONFLICT(nome) DO UPDATE SET refs = refs + 1;
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS fotos_ref_ad AFTER DELETE ON produtos
+    WHEN old.foto IS NOT NULL AND old.foto != '' BEGIN
+        UPDATE fotos SET refs = refs - 1 WHERE nome = old.foto;
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS fotos_ref_au AFTER UPDATE OF foto ON produtos
+    WHEN old.foto IS NOT new.foto BEGIN
+        UPDATE fotos SET refs = refs - 1 WHERE nome = old.foto;
+        INSERT INTO fotos (nome, refs)
+        SELECT new.foto, 1 WHERE new.foto IS NOT NULL AND new.foto != ''
+        ON CONFLICT(nome) DO UPDATE SET refs = refs + 1;
+    END;
+    """)
+    if not fotos_existia:
+        migrate_fotos_to_content_addressed(cursor)
+
+    # ---------- TABELA VENDAS ----------
+    # Livro de vendas só de inserção. Sem FK para produtos: o histórico
+    # continua valendo mesmo que o produto seja excluído depois.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS vendas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        produto_id INTEGER NOT NULL,
+        quantidade INTEGER NOT NULL,
+        preco_unitario REAL NOT NULL,
+        data TEXT NOT NULL,
+        usuario TEXT
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_vendas_data
+        ON vendas (data, produto_id, quantidade, preco_unitario);
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_vendas_produto
+        ON vendas (produto_id, data, quantidade, preco_unitario);
+    """)
+
+    # ---------- RESUMOS DIÁRIOS DE VENDAS ----------
+    # Mantidos pelo trigger de vendas: os painéis leem no máximo uma linha
+    # por dia x produto (ou marca), independente do tamanho do histórico.
+    rollups_existiam = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'vendas_diarias_produto'"
+    ).fetchone()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS vendas_diarias_produto (
+        dia TEXT NOT NULL,
+        produto_id INTEGER NOT NULL,
+        unidades INTEGER NOT NULL DEFAULT 0,
+        faturamento REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, produto_id)
+    ) WITHOUT ROWID;
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS vendas_diarias_marca (
+        dia TEXT NOT NULL,
+        marca TEXT NOT NULL,
+        unidades INTEGER NOT NULL DEFAULT 0,
+        faturamento REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, marca)
+    ) WITHOUT ROWID;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS vendas_rollup_ai AFTER INSERT ON vendas BEGIN
+        INSERT INTO vendas_diarias_produto (dia, produto_id, unidades, faturamento)
+        VALUES (substr(new.data, 1, 10), new.produto_id, new.quantidade,
+                new.quantidade * new.preco_unitario)
+        ON CONFLICT (dia, produto_id) DO UPDATE SET
+            unidades = unidades + excluded.unidades,
+            faturamento = faturamento + excluded.faturamento;
+        INSERT INTO vendas_diarias_marca (dia, marca, unidades, faturamento)
+        VALUES (substr(new.data, 1, 10),
+                COALESCE((SELECT marca FROM produtos WHERE id = new.produto_id), ''),
+                new.quantidade, new.quantidade * new.preco_unitario)
+        ON CONFLICT (dia, marca) DO UPDATE SET
+            unidades = unidades + excluded.unidades,
+            faturamento = faturamento + excluded.faturamento;
+    END;
+    """)
+    if not rollups_existiam:
+        # Bancos que já tinham vendas: monta os resumos a partir do livro
+        cursor.execute("""
+            INSERT INTO vendas_diarias_produto (dia, produto_id, unidades, faturamento)
+            SELECT substr(data, 1, 10), produto_id, SUM(quantidade),
+                   SUM(quantidade * preco_unitario)
+            FROM vendas GROUP BY 1, 2
+        """)
+        cursor.execute("""
+            INSERT INTO vendas_diarias_marca (dia, marca, unidades, faturamento)
+            SELECT substr(v.data, 1, 10), COALESCE(p.marca, ''), SUM(v.quantidade),
+                   SUM(v.quantidade * v.preco_unitario)
+            FROM vendas v LEFT JOIN produtos p ON p.id = v.produto_id
+            GROUP BY 1, 2
+        """)
+
+    # ---------- METADADOS ----------
+    # Contadores de versão: incrementados a cada escrita em produtos, servem
+    # de chave para caches (ex.: exportação CSV) entre reruns e processos.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS app_meta (
+        chave TEXT PRIMARY KEY,
+        valor INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    cursor.execute(
+        "INSERT OR IGNORE INTO app_meta (chave, valor) VALUES ('produtos_version', 0)"
+    )
+
     # ---------- TABELA USUÁRIOS ----------
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -86,41 +693,249 @@ def create_tables():
     """)
 
     # Cria usuário admin padrão, se não existir
-    try:
+    cursor.execute(
+        "INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)",
+        ("admin", hash_password("123"), "admin")
+    )
+
+def _migration_2_indices_datas(cursor):
+    # nome já é coberto pelo prefixo de idx_produtos_nome_marca; marca e tipo
+    # têm índices próprios desde a versão 1.
+    for coluna in ("data_validade", "data_ultima_venda"):
         cursor.execute(
-            "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-            ("admin", hash_password("123"), "admin")
+            f"CREATE INDEX IF NOT EXISTS idx_produtos_{coluna} ON produtos ({coluna})"
         )
-    except sqlite3.IntegrityError:
-        # Já existe admin, então ignora
-        pass
 
-    conn.commit()
-    conn.close()
+def _migration_3_quantidade_inicial(cursor):
+    colunas = {r["name"] for r in cursor.execute("PRAGMA table_info(produtos)")}
+    if "quantidade_inicial" not in colunas:
+        cursor.execute("ALTER TABLE produtos ADD COLUMN quantidade_inicial INTEGER")
+    # Produtos existentes: estoque atual mais o que já foi vendido
+    cursor.execute("""
+        UPDATE produtos SET quantidade_inicial = quantidade + COALESCE(
+            (SELECT SUM(v.quantidade) FROM vendas v WHERE v.produto_id = produtos.id), 0)
+        WHERE quantidade_inicial IS NULL
+    """)
 
-# Garante criação das tabelas ao importar o módulo
-create_tables()
+def _migration_4_normaliza_validade(cursor):
+    # Validades antigas em texto livre passam para AAAA-MM-DD, o que torna a
+    # ordem do texto igual à ordem das datas (consultas por intervalo usam
+    # idx_produtos_data_validade). Valores ilegíveis viram NULL: as escritas
+    # passam a rejeitar datas inválidas e não poderiam regravá-los.
+    alterados = []
+    for pid, valor in cursor.execute(
+        "SELECT id, data_validade FROM produtos WHERE data_validade IS NOT NULL"
+    ).fetchall():
+        try:
+            iso = normalize_date(valor)
+        except ValueError:
+            iso = None
+        if iso != valor:
+            alterados.append((iso, pid))
+    cursor.executemany("UPDATE produtos SET data_validade = ? WHERE id = ?", alterados)
+
+def _migration_5_velocidade_vendas(cursor):
+    # Estado incremental da velocidade de vendas (média móvel exponencial por
+    # produto), mantido por utils/reposicao.py a partir do livro de vendas.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS vendas_velocidade (
+        produto_id INTEGER PRIMARY KEY,
+        taxa REAL NOT NULL DEFAULT 0,
+        dia_ref TEXT NOT NULL
+    );
+    """)
+    cursor.execute(
+        "INSERT OR IGNORE INTO app_meta (chave, valor) VALUES ('velocidade_ultima_venda', 0)"
+    )
+
+def _migration_6_tarefas(cursor):
+    # Fila de tarefas em segundo plano (relatórios, exportações e
+    # importações) de utils/tarefas.py. Os arquivos gerados ficam em disco;
+    # aqui só o caminho. chave identifica pedidos iguais para reaproveitá-los.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS tarefas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo TEXT NOT NULL,
+        chave TEXT NOT NULL,
+        params TEXT,
+        status TEXT NOT NULL DEFAULT 'pendente',
+        usuario TEXT,
+        pid INTEGER,
+        criada_em TEXT NOT NULL,
+        iniciada_em TEXT,
+        concluida_em TEXT,
+        arquivo TEXT,
+        nome_arquivo TEXT,
+        resultado TEXT,
+        erro TEXT
+    );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_chave ON tarefas(chave, status);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_criada ON tarefas(criada_em);")
+
+def _migration_7_sessoes(cursor):
+    # Sessões de login (ver SESSÕES): só o hash do token é guardado. O
+    # segredo que assina os tokens ficava em app_meta (a migração 8 o move).
+    import secrets
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        token_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        username TEXT NOT NULL,
+        role TEXT NOT NULL,
+        criada_em TEXT NOT NULL,
+        expira_em TEXT NOT NULL
+    );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expira ON sessions(expira_em);")
+    cursor.execute(
+        "INSERT OR IGNORE INTO app_meta (chave, valor) VALUES ('session_secret', ?)",
+        (secrets.token_urlsafe(32),)
+    )
+
+def _migration_8_segredos(cursor):
+    # Segredos em tabela própria, com valor TEXT: app_meta.valor é INTEGER
+    # e guarda só contadores. O segredo das sessões que a migração 7 gravou
+    # em app_meta é movido para cá (as sessões abertas continuam valendo).
+    import secrets
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS segredos (
+        nome TEXT PRIMARY KEY,
+        valor TEXT NOT NULL
+    );
+    """)
+    cursor.execute(
+        "INSERT OR IGNORE INTO segredos (nome, valor) "
+        "SELECT chave, CAST(valor AS TEXT) FROM app_meta WHERE chave = 'session_secret'"
+    )
+    cursor.execute(
+        "INSERT OR IGNORE INTO segredos (nome, valor) VALUES ('session_secret', ?)",
+        (secrets.token_urlsafe(32),)
+    )
+    cursor.execute("DELETE FROM app_meta WHERE chave = 'session_secret'")
+
+# (versão, migração) em ordem; nunca altere uma migração já publicada,
+# acrescente uma nova no fim.
+MIGRATIONS = (
+    (1, _migration_1_esquema_base),
+    (2, _migration_2_indices_datas),
+    (3, _migration_3_quantidade_inicial),
+    (4, _migration_4_normaliza_validade),
+    (5, _migration_5_velocidade_vendas),
+    (6, _migration_6_tarefas),
+    (7, _migration_7_sessoes),
+    (8, _migration_8_segredos),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_schema_ok = set()
+_schema_lock = threading.RLock()
+
+def get_schema_version():
+    conn = get_db_connection()
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        release_db_connection(conn)
+
+def run_migrations():
+    """
+    Aplica as migrações pendentes. Roda no máximo uma vez por processo (e
+    por banco); com o esquema em dia é só a leitura de PRAGMA user_version.
+    """
+    with _schema_lock:
+        if DATABASE in _schema_ok:
+            return
+        # Direto do pool: get_db_connection() chamaria init_db() de novo
+        pool = _get_pool()
+        conn = pool.acquire()
+        _fotos_pos_migracao.clear()
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                conn.execute("BEGIN IMMEDIATE")
+                # Relido com o lock de escrita: outro processo pode ter migrado
+                versao = conn.execute("PRAGMA user_version").fetchone()[0]
+                cursor = conn.cursor()
+                for numero, migracao in MIGRATIONS:
+                    if numero > versao:
+                        migracao(cursor)
+                        cursor.execute(f"PRAGMA user_version = {numero}")
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            _fotos_pos_migracao.clear()
+            raise
+        finally:
+            pool.release(conn)
+        _apply_fotos_pos_migracao()
+        _schema_ok.add(DATABASE)
+
+def init_db():
+    """
+    Cria os diretórios de dados e aplica as migrações. Idempotente e barata
+    depois da primeira chamada; get_db_connection() a chama sozinha, mas
+    scripts podem chamá-la antes para falhar cedo.
+    """
+    if DATABASE in _schema_ok:
+        return
+    with _schema_lock:
+        os.makedirs(os.path.dirname(DATABASE) or ".", exist_ok=True)
+        os.makedirs(ASSETS_DIR, exist_ok=True)
+        run_migrations()
+
+def create_tables():
+    """Mantido por compatibilidade: equivale a init_db()."""
+    init_db()
 
 # ---------- PRODUTOS ----------
 
+def _bump_produtos_version(cursor):
+    # Chamar dentro da transação que alterou produtos
+    cursor.execute(
+        "UPDATE app_meta SET valor = valor + 1 WHERE chave = 'produtos_version'"
+    )
+
+def get_produtos_version():
+    """Versão atual da tabela produtos; muda a cada escrita confirmada."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT valor FROM app_meta WHERE chave = 'produtos_version'"
+        ).fetchone()
+        return row[0] if row else 0
+    finally:
+        release_db_connection(conn)
+
 def add_produto(nome, preco, quantidade, marca, estilo, tipo, foto=None, data_validade=None):
+    data_validade = normalize_date(data_validade)
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
         conn.execute("BEGIN")
         cursor.execute("""
-            INSERT INTO produtos (nome, preco, quantidade, marca, estilo, tipo, foto, data_validade)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (nome, preco, quantidade, marca, estilo, tipo, foto, data_validade))
+            INSERT INTO produtos (nome, preco, quantidade, marca, estilo, tipo, foto,
+                                  data_validade, quantidade_inicial)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (nome, preco, quantidade, marca, estilo, tipo, foto, data_validade, quantidade))
+        product_id = cursor.lastrowid
+        _bump_produtos_version(cursor)
         conn.commit()
-        return cursor.lastrowid
+        invalidate_produtos_cache(ids=[product_id])
+        return product_id
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_all_produtos(include_sold: bool = True):
+    return _produtos_cache.get_or_load(("all", bool(include_sold)),
+                                       lambda: _load_all_produtos(include_sold))
+
+def _load_all_produtos(include_sold):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
@@ -130,74 +945,640 @@ def get_all_produtos(include_sold: bool = True):
             cursor.execute("SELECT * FROM produtos WHERE quantidade > 0 ORDER BY nome ASC")
         return [dict(r) for r in cursor.fetchall()]
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+# Ordenações aceitas por query_produtos (nunca interpolar texto do usuário)
+ORDENACOES = {
+    "nome": "nome ASC, id ASC",
+    "preco": "preco ASC, id ASC",
+    "-preco": "preco DESC, id ASC",
+    "quantidade": "quantidade ASC, id ASC",
+    "-quantidade": "quantidade DESC, id ASC",
+    "-id": "id DESC",
+}
+
+def _produtos_where(filters):
+    """
+    Monta a cláusula WHERE a partir de um dict de filtros:
+    marca, estilo, tipo, qtd_min, busca e include_sold.
+    """
+    filters = filters or {}
+    clauses, params = [], []
+    for campo in ("marca", "estilo", "tipo"):
+        valor = filters.get(campo)
+        if valor:
+            clauses.append(f"{campo} = ?")
+            params.append(valor)
+    qtd_min = safe_int(filters.get("qtd_min", 0))
+    if not filters.get("include_sold", True):
+        qtd_min = max(qtd_min, 1)
+    if qtd_min > 0:
+        clauses.append("quantidade >= ?")
+        params.append(qtd_min)
+    match = _fts_match(filters.get("busca"))
+    if match:
+        clauses.append("id IN (SELECT rowid FROM produtos_fts WHERE produtos_fts MATCH ?)")
+        params.append(match)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+def _fts_match(texto):
+    """
+    Converte o texto digitado numa consulta FTS5: cada palavra vira um
+    prefixo entre aspas ("frag"*), todas obrigatórias. Aspas e operadores
+    digitados pelo usuário nunca chegam ao MATCH.
+    """
+    palavras = re.findall(r"\w+", texto or "")
+    return " ".join(f'"{p}"*' for p in palavras)
+
+def search_produtos(q, limit=20):
+    """
+    Busca textual em nome, marca, estilo e tipo, sem diferenciar acentos,
+    ordenada por relevância (BM25, com peso maior para o nome).
+    """
+    match = _fts_match(q)
+    if not match:
+        return []
+    limit = safe_int(limit, 20)
+
+    def load():
+        conn = get_db_connection()
+        try:
+            rows = conn.execute("""
+                SELECT p.* FROM produtos_fts
+                JOIN produtos p ON p.id = produtos_fts.rowid
+                WHERE produtos_fts MATCH ?
+                ORDER BY bm25(produtos_fts, 10.0, 3.0, 1.0, 1.0)
+                LIMIT ?
+            """, (match, limit)).fetchall()
+            return [dict(r) for r in rows]
+        finally:
+            release_db_connection(conn)
+
+    return _produtos_cache.get_or_load(("search", match, limit), load)
+
+def _filters_key(filters):
+    return tuple(sorted((filters or {}).items()))
+
+def query_produtos(filters=None, order="nome", limit=None, offset=0):
+    """Busca produtos filtrando, ordenando e paginando no próprio SQLite."""
+    where, params = _produtos_where(filters)
+    sql = f"SELECT * FROM produtos{where} ORDER BY {ORDENACOES.get(order, ORDENACOES['nome'])}"
+    if limit is not None:
+        limit, offset = safe_int(limit), max(safe_int(offset), 0)
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+
+    def load():
+        conn = get_db_connection()
+        try:
+            return [dict(r) for r in conn.execute(sql, params).fetchall()]
+        finally:
+            release_db_connection(conn)
+
+    key = ("query", _filters_key(filters), order, limit, offset if limit is not None else 0)
+    return _produtos_cache.get_or_load(key, load)
+
+def get_inventory_valuation(filters=None, group_by=None):
+    """
+    Valor do estoque (SUM(preco * quantidade)) calculado no SQLite.
+
+    Sem group_by retorna {"itens", "unidades", "valor"}; com group_by
+    ("marca", "estilo" ou "tipo") retorna uma lista desses dicts com o campo
+    do grupo. O resultado fica no cache de leitura até a próxima escrita em
+    produtos; a versão em app_meta entra na chave para que escritas de outro
+    processo também sejam percebidas.
+    """
+    if group_by not in (None, "marca", "estilo", "tipo"):
+        raise ValueError(f"Agrupamento inválido: {group_by}")
+
+    def load():
+        where, params = _produtos_where(filters)
+        colunas = ("COUNT(*) AS itens, COALESCE(SUM(quantidade), 0) AS unidades, "
+                   "COALESCE(SUM(preco * quantidade), 0) AS valor")
+        if group_by:
+            sql = (f"SELECT {group_by}, {colunas} FROM produtos{where} "
+                   f"GROUP BY {group_by} ORDER BY valor DESC")
+        else:
+            sql = f"SELECT {colunas} FROM produtos{where}"
+        conn = get_db_connection()
+        try:
+            rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+        finally:
+            release_db_connection(conn)
+        return rows if group_by else rows[0]
+
+    key = ("valuation", get_produtos_version(), group_by, _filters_key(filters))
+    return _produtos_cache.get_or_load(key, load)
+
+def get_produtos_summary(filters=None):
+    """Quantidade de produtos e valor em estoque que atendem aos filtros."""
+    v = get_inventory_valuation(filters)
+    return {"total": v["itens"], "valor": v["valor"]}
+
+def get_distinct_values(campo):
+    """Valores distintos (não vazios) de marca, estilo ou tipo."""
+    if campo not in ("marca", "estilo", "tipo"):
+        raise ValueError(f"Campo inválido: {campo}")
+
+    def load():
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(
+                f"SELECT DISTINCT {campo} FROM produtos "
+                f"WHERE {campo} IS NOT NULL AND {campo} != '' ORDER BY {campo}"
+            ).fetchall()
+            return [r[0] for r in rows]
+        finally:
+            release_db_connection(conn)
+
+    return _produtos_cache.get_or_load(("distinct", campo), load)
 
 def get_produto_by_id(product_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT * FROM produtos WHERE id = ?", (product_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    product_id = safe_int(product_id)
+
+    def load():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT * FROM produtos WHERE id = ?", (product_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        finally:
+            release_db_connection(conn)
+
+    return _produtos_cache.get_or_load(("id", product_id), load)
+
+def get_expiring_produtos(days=30, limit=50, include_expired=True, include_sold=False):
+    """
+    Produtos que vencem nos próximos `days` dias (hoje incluso), do mais
+    próximo ao mais distante, com "dias_restantes" (negativo = vencido).
+    Consulta por intervalo em idx_produtos_data_validade: só as linhas do
+    período são lidas. include_expired inclui os que já venceram.
+    """
+    hoje = date.today()
+    fim = (hoje + timedelta(days=max(safe_int(days), 0))).isoformat()
+    inicio = None if include_expired else hoje.isoformat()
+    limit = safe_int(limit, 50)
 
-def update_produto(product_id, nome, preco, quantidade, marca, estilo, tipo, foto, data_validade):
+    def load():
+        clauses, params = ["data_validade <= ?"], [fim]
+        if inicio:
+            clauses.append("data_validade >= ?")
+            params.append(inicio)
+        else:
+            clauses.append("data_validade IS NOT NULL")
+        if not include_sold:
+            clauses.append("quantidade > 0")
+        params.append(limit)
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(
+                f"SELECT * FROM produtos WHERE {' AND '.join(clauses)} "
+                f"ORDER BY data_validade ASC, id ASC LIMIT ?", params
+            ).fetchall()
+        finally:
+            release_db_connection(conn)
+        produtos = []
+        for r in rows:
+            p = dict(r)
+            try:
+                p["dias_restantes"] = (date.fromisoformat(p["data_validade"]) - hoje).days
+            except ValueError:
+                p["dias_restantes"] = None
+            produtos.append(p)
+        return produtos
+
+    key = ("expiring", hoje.isoformat(), fim, inicio, bool(include_sold), limit)
+    return _produtos_cache.get_or_load(key, load)
+
+def count_expired_produtos(include_sold=False):
+    """Quantos produtos já passaram da data de validade (contados no SQLite)."""
+    hoje = date.today().isoformat()
+
+    def load():
+        sql = "SELECT COUNT(*) FROM produtos WHERE data_validade < ?"
+        if not include_sold:
+            sql += " AND quantidade > 0"
+        conn = get_db_connection()
+        try:
+            return conn.execute(sql, (hoje,)).fetchone()[0]
+        finally:
+            release_db_connection(conn)
+
+    return _produtos_cache.get_or_load(("expired", hoje, bool(include_sold)), load)
+
+def update_produto(product_id, nome, preco, quantidade, marca, estilo, tipo, foto, data_validade,
+                   quantidade_lida=None):
+    """
+    quantidade_lida: quantidade exibida no formulário. Quando informada, o
+    estoque é ajustado pela diferença (quantidade - quantidade_lida) em vez
+    de sobrescrito, para não desfazer vendas gravadas enquanto o formulário
+    estava aberto.
+    """
+    data_validade = normalize_date(data_validade)
+    if quantidade_lida is None:
+        expr_qtd, arg_qtd = "?", quantidade
+    else:
+        expr_qtd, arg_qtd = "MAX(quantidade + ?, 0)", safe_int(quantidade) - safe_int(quantidade_lida)
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        conn.execute("BEGIN")
-        cursor.execute("""
+        conn.execute("BEGIN IMMEDIATE")
+        row = cursor.execute("SELECT foto FROM produtos WHERE id = ?", (product_id,)).fetchone()
+        cursor.execute(f"""
             UPDATE produtos
-            SET nome=?, preco=?, quantidade=?, marca=?, estilo=?, tipo=?, foto=?, data_validade=?
+            SET nome=?, preco=?, quantidade={expr_qtd}, marca=?, estilo=?, tipo=?, foto=?, data_validade=?
             WHERE id=?
-        """, (nome, preco, quantidade, marca, estilo, tipo, foto, data_validade, product_id))
+        """, (nome, preco, arg_qtd, marca, estilo, tipo, foto, data_validade, product_id))
+        updated = cursor.rowcount > 0
+        if row and row["foto"] and row["foto"] != foto:
+            _drop_orphan_fotos(cursor, [row["foto"]])
+        if updated:
+            _bump_produtos_version(cursor)
         conn.commit()
-        return cursor.rowcount > 0
+        invalidate_produtos_cache(ids=[product_id])
+        return updated
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def delete_produto(product_id: int):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        conn.execute("BEGIN")
-        produto = get_produto_by_id(product_id)
-        if produto and produto.get("foto"):
-            try:
-                os.remove(os.path.join(ASSETS_DIR, produto["foto"]))
-            except FileNotFoundError:
-                pass
+        conn.execute("BEGIN IMMEDIATE")
+        row = cursor.execute("SELECT foto FROM produtos WHERE id = ?", (product_id,)).fetchone()
         cursor.execute("DELETE FROM produtos WHERE id = ?", (product_id,))
+        deleted = cursor.rowcount > 0
+        if row and row["foto"]:
+            _drop_orphan_fotos(cursor, [row["foto"]])
+        if deleted:
+            _bump_produtos_version(cursor)
         conn.commit()
-        return cursor.rowcount > 0
+        invalidate_produtos_cache(ids=[product_id])
+        return deleted
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-def mark_produto_as_sold(product_id: int, quantity_sold: int = 1):
+def mark_produto_as_sold(product_id: int, quantity_sold: int = 1, usuario=None):
+    mark_produtos_as_sold([(product_id, quantity_sold)], usuario=usuario)
+
+def mark_produtos_as_sold(itens, usuario=None):
+    """
+    Registra a venda de vários itens [(id, qtd), ...] numa única transação.
+    A baixa é condicional (quantidade >= qtd), então duas vendas simultâneas
+    do mesmo produto nunca deixam o estoque negativo. Se algum item não tiver
+    estoque suficiente, nada é gravado. Cada item vira uma linha em vendas,
+    com o preço unitário do momento da venda.
+    """
+    itens = _itens_venda(itens)
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        conn.execute("BEGIN")
-        produto = get_produto_by_id(product_id)
-        if not produto or safe_int(produto.get("quantidade", 0)) < quantity_sold:
-            raise ValueError("Estoque insuficiente!")
+        conn.execute("BEGIN IMMEDIATE")
+        _sell(cursor, itens, usuario)
+        _bump_produtos_version(cursor)
+        conn.commit()
+        invalidate_produtos_cache(ids=[pid for pid, _ in itens])
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+def _itens_venda(itens):
+    itens = [(safe_int(pid), safe_int(qtd)) for pid, qtd in itens]
+    if any(qtd <= 0 for _, qtd in itens):
+        raise ValueError("Quantidade de venda inválida!")
+    return itens
+
+def _sell(cursor, itens, usuario):
+    """Baixa condicional e linhas em vendas, dentro da transação de quem chama."""
+    agora = datetime.now().isoformat()
+    vendas = []
+    for pid, qtd in itens:
+        row = cursor.execute(
+            "UPDATE produtos SET quantidade = quantidade - ?, data_ultima_venda = ? "
+            "WHERE id = ? AND quantidade >= ? RETURNING preco",
+            (qtd, agora, pid, qtd)
+        ).fetchall()
+        if not row:
+            raise ValueError(f"Estoque insuficiente! (ID {pid})")
+        vendas.append((pid, qtd, row[0]["preco"], agora, usuario))
+    cursor.executemany(
+        "INSERT INTO vendas (produto_id, quantidade, preco_unitario, data, usuario) "
+        "VALUES (?, ?, ?, ?, ?)",
+        vendas
+    )
+
+# ---------- OPERAÇÕES EM LOTE ----------
+
+def bulk_update_prices(filters=None, pct=None, valor=None):
+    """
+    Reajusta de uma vez o preço de todos os produtos que atendem aos filtros
+    (os mesmos de query_produtos). Informe pct (10 = +10%, -5 = -5%) ou valor
+    (soma em R$, pode ser negativo). Preços nunca ficam abaixo de zero.
+    Retorna quantos produtos foram alterados.
+    """
+    if (pct is None) == (valor is None):
+        raise ValueError("Informe pct ou valor para o reajuste.")
+    if pct is not None:
+        expr, arg = "preco * (1 + ? / 100.0)", safe_float(pct)
+    else:
+        expr, arg = "preco + ?", safe_float(valor)
+    where, params = _produtos_where(filters)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
         cursor.execute(
-            "UPDATE produtos SET quantidade = quantidade - ?, data_ultima_venda = ? WHERE id = ?",
-            (quantity_sold, datetime.now().isoformat(), product_id)
+            f"UPDATE produtos SET preco = MAX(ROUND({expr}, 2), 0){where}",
+            [arg] + params
         )
+        alterados = cursor.rowcount
+        if alterados:
+            _bump_produtos_version(cursor)
         conn.commit()
+        invalidate_produtos_cache()
+        return alterados
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+def _produtos_where_lote(filters):
+    """
+    _produtos_where para as operações em lote por filtro: recusa filtro
+    vazio e busca que não vira consulta FTS (seria ignorada e a operação
+    cairia no catálogo inteiro).
+    """
+    busca = (filters or {}).get("busca")
+    if busca and not _fts_match(busca):
+        raise ValueError("A busca não tem termos válidos.")
+    where, params = _produtos_where(filters)
+    if not where:
+        raise ValueError("Selecione ao menos um filtro.")
+    return where, params
+
+def get_produto_ids(filters):
+    """
+    Ids dos produtos que atendem aos filtros, para uma operação em lote
+    confirmada pelo usuário (ex.: bulk_delete). Filtro vazio ou busca sem
+    termos válidos geram ValueError.
+    """
+    where, params = _produtos_where_lote(filters)
+    conn = get_db_connection()
+    try:
+        return [r[0] for r in conn.execute(
+            f"SELECT id FROM produtos{where} ORDER BY id", params
+        ).fetchall()]
+    finally:
+        release_db_connection(conn)
+
+def bulk_restock(itens):
+    """
+    Soma estoque a vários produtos [(id, qtd), ...] numa única transação.
+    Retorna quantos produtos foram encontrados e atualizados.
+    """
+    itens = [(safe_int(qtd), safe_int(pid)) for pid, qtd in itens]
+    if any(qtd <= 0 for qtd, _ in itens):
+        raise ValueError("Quantidade de reposição inválida!")
+    if not itens:
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor.executemany(
+            "UPDATE produtos SET quantidade = quantidade + ? WHERE id = ?", itens
+        )
+        alterados = cursor.rowcount
+        if alterados:
+            _bump_produtos_version(cursor)
+        conn.commit()
+        invalidate_produtos_cache(ids=[pid for _, pid in itens])
+        return alterados
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+def bulk_restock_by_filter(filters, qtd):
+    """
+    Soma qtd unidades ao estoque de todos os produtos que atendem aos
+    filtros (os mesmos de query_produtos), num único UPDATE. Filtro vazio
+    ou busca sem termos válidos geram ValueError. Retorna quantos foram
+    alterados.
+    """
+    qtd = safe_int(qtd)
+    if qtd <= 0:
+        raise ValueError("Quantidade de reposição inválida!")
+    where, params = _produtos_where_lote(filters)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"UPDATE produtos SET quantidade = quantidade + ?{where}", [qtd] + params)
+        alterados = cursor.rowcount
+        if alterados:
+            _bump_produtos_version(cursor)
+        conn.commit()
+        invalidate_produtos_cache()
+        return alterados
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+def bulk_delete(ids):
+    """
+    Exclui vários produtos numa única transação e apaga, no fim, as fotos
+    que ficaram sem uso. Retorna quantos produtos foram excluídos.
+    """
+    ids = sorted({safe_int(pid) for pid in ids})
+    if not ids:
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        fotos = []
+        for i in range(0, len(ids), SQL_IN_CHUNK):
+            bloco = ids[i:i + SQL_IN_CHUNK]
+            marks = ",".join("?" * len(bloco))
+            fotos += [r[0] for r in cursor.execute(
+                f"SELECT DISTINCT foto FROM produtos WHERE id IN ({marks}) AND foto IS NOT NULL",
+                bloco
+            ).fetchall()]
+        cursor.executemany("DELETE FROM produtos WHERE id = ?", [(pid,) for pid in ids])
+        excluidos = cursor.rowcount
+        _drop_orphan_fotos(cursor, fotos)
+        if excluidos:
+            _bump_produtos_version(cursor)
+        conn.commit()
+        invalidate_produtos_cache(ids=ids)
+        return excluidos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+def apply_produto_changes(edicoes=(), reposicoes=(), vendas=(), exclusoes=(), usuario=None):
+    """
+    Grava de uma vez as alterações da tabela de produtos, numa única
+    transação: se qualquer parte falhar (ex.: estoque insuficiente numa
+    venda), nada é gravado e tudo pode ser reenviado sem duplicar.
+
+    edicoes: [(id, campos, quantidade_lida)], campos com "nome", "preco"
+             e/ou "quantidade"; a quantidade é ajustada pela diferença
+             em relação a quantidade_lida (ver update_produto).
+    reposicoes, vendas: [(id, qtd), ...]
+    exclusoes: ids a excluir (fotos sem uso são apagadas no fim).
+
+    Retorna {"alterados", "repostos", "vendidos", "excluidos"}.
+    """
+    reposicoes = [(safe_int(qtd), safe_int(pid)) for pid, qtd in reposicoes]
+    if any(qtd <= 0 for qtd, _ in reposicoes):
+        raise ValueError("Quantidade de reposição inválida!")
+    vendas = _itens_venda(vendas)
+    exclusoes = sorted({safe_int(pid) for pid in exclusoes})
+    res = {"alterados": 0, "repostos": 0, "vendidos": 0, "excluidos": 0}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for pid, campos, quantidade_lida in edicoes:
+            sets, params = [], []
+            for campo, conv in (("nome", str), ("preco", safe_float)):
+                if campo in campos:
+                    sets.append(f"{campo} = ?")
+                    params.append(conv(campos[campo]))
+            if "quantidade" in campos:
+                sets.append("quantidade = MAX(quantidade + ?, 0)")
+                params.append(safe_int(campos["quantidade"]) - safe_int(quantidade_lida))
+            if sets:
+                cursor.execute(f"UPDATE produtos SET {', '.join(sets)} WHERE id = ?",
+                               params + [safe_int(pid)])
+                res["alterados"] += cursor.rowcount
+        if reposicoes:
+            cursor.executemany(
+                "UPDATE produtos SET quantidade = quantidade + ? WHERE id = ?", reposicoes
+            )
+            res["repostos"] = cursor.rowcount
+        if vendas:
+            _sell(cursor, vendas, usuario)
+            res["vendidos"] = len(vendas)
+        fotos = []
+        for i in range(0, len(exclusoes), SQL_IN_CHUNK):
+            bloco = exclusoes[i:i + SQL_IN_CHUNK]
+            marks = ",".join("?" * len(bloco))
+            fotos += [r[0] for r in cursor.execute(
+                f"SELECT foto FROM produtos WHERE id IN ({marks}) AND foto IS NOT NULL", bloco
+            ).fetchall()]
+            cursor.execute(f"DELETE FROM produtos WHERE id IN ({marks})", bloco)
+            res["excluidos"] += cursor.rowcount
+        _drop_orphan_fotos(cursor, fotos)
+        if any(res.values()):
+            _bump_produtos_version(cursor)
+        conn.commit()
+        invalidate_produtos_cache(ids=[e[0] for e in edicoes] + [pid for _, pid in reposicoes]
+                                  + [pid for pid, _ in vendas] + exclusoes)
+        return res
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+# ---------- VENDAS ----------
+
+# Períodos aceitos por get_sales_summary (dias para trás, incluindo hoje)
+PERIODOS = {"hoje": 1, "7d": 7, "30d": 30, "90d": 90, "365d": 365, "tudo": None}
+
+def _periodo_dias(period):
+    """Converte o período em (dia_inicio, dia_fim) ISO, fim inclusivo."""
+    if isinstance(period, (tuple, list)):
+        inicio, fim = period
+        return (str(inicio) if inicio else None, str(fim) if fim else None)
+    if period not in PERIODOS:
+        raise ValueError(f"Período inválido: {period}")
+    dias = PERIODOS[period]
+    if dias is None:
+        return None, None
+    hoje = date.today()
+    return (hoje - timedelta(days=dias - 1)).isoformat(), hoje.isoformat()
+
+def get_sales_summary(period="30d", group_by=None, limit=None, offset=0):
+    """
+    Resumo de vendas lido das tabelas diárias.
+
+    period: chave de PERIODOS ou (dia_inicio, dia_fim) em ISO.
+    group_by: None (totais), "dia", "produto" ou "marca".
+    Sem group_by retorna um dict; nos demais casos, uma lista de dicts
+    com unidades e faturamento por grupo (limit/offset para paginar).
+    """
+    inicio, fim = _periodo_dias(period)
+    clauses, params = [], []
+    if inicio:
+        clauses.append("r.dia >= ?")
+        params.append(inicio)
+    if fim:
+        clauses.append("r.dia <= ?")
+        params.append(fim)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+
+    if group_by is None:
+        sql = f"""
+            SELECT COUNT(DISTINCT r.produto_id) AS produtos,
+                   COALESCE(SUM(r.unidades), 0) AS unidades,
+                   COALESCE(SUM(r.faturamento), 0) AS faturamento
+            FROM vendas_diarias_produto r{where}
+        """
+    elif group_by == "dia":
+        sql = f"""
+            SELECT r.dia, SUM(r.unidades) AS unidades, SUM(r.faturamento) AS faturamento
+            FROM vendas_diarias_marca r{where}
+            GROUP BY r.dia ORDER BY r.dia
+        """
+    elif group_by == "marca":
+        sql = f"""
+            SELECT r.marca, SUM(r.unidades) AS unidades, SUM(r.faturamento) AS faturamento
+            FROM vendas_diarias_marca r{where}
+            GROUP BY r.marca ORDER BY faturamento DESC
+        """
+    elif group_by == "produto":
+        sql = f"""
+            SELECT r.produto_id, p.nome, p.marca, p.tipo, p.foto, p.preco, p.quantidade,
+                   SUM(r.unidades) AS unidades, SUM(r.faturamento) AS faturamento,
+                   MAX(r.dia) AS ultimo_dia
+            FROM vendas_diarias_produto r
+            LEFT JOIN produtos p ON p.id = r.produto_id{where}
+            GROUP BY r.produto_id ORDER BY unidades DESC, ultimo_dia DESC
+        """
+    else:
+        raise ValueError(f"Agrupamento inválido: {group_by}")
+    if group_by and limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [safe_int(limit), max(safe_int(offset), 0)]
+
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(sql, params).fetchall()
+        if group_by is None:
+            return dict(rows[0])
+        return [dict(r) for r in rows]
+    finally:
+        release_db_connection(conn)
 
 # ---------- USUÁRIOS ----------
 
@@ -214,40 +1595,77 @@ def add_user(username, password, role="user"):
             (username, hash_password(password), role)
         )
         conn.commit()
+        invalidate_users_cache()
         return True
     except sqlite3.IntegrityError:
         # username já existe
         conn.rollback()
         return False
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_user(username):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    def load():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        finally:
+            release_db_connection(conn)
+
+    return _users_cache.get_or_load(("user", username), load)
 
 def get_all_users():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "SELECT id, username, role FROM users ORDER BY role DESC, username ASC"
-        )
-        return [dict(r) for r in cursor.fetchall()]
-    finally:
-        conn.close()
+    def load():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT id, username, role FROM users ORDER BY role DESC, username ASC"
+            )
+            return [dict(r) for r in cursor.fetchall()]
+        finally:
+            release_db_connection(conn)
+
+    return _users_cache.get_or_load(("all",), load)
+
+# Usado quando o usuário não existe, para a resposta levar o mesmo tempo
+_DUMMY_HASH = None
 
 def check_user_login(username, password):
+    """
+    Verificação completa (e cara) da senha, feita só no login. Hashes
+    antigos são regravados no formato atual quando a senha confere.
+    Retorna o usuário ou None.
+    """
+    global _DUMMY_HASH
     user = get_user(username)
-    if user and user["password"] == hash_password(password):
-        return user
-    return None
+    if not user:
+        if _DUMMY_HASH is None:
+            import secrets
+
+            _DUMMY_HASH = hash_password(secrets.token_hex(8))
+        verify_password(password, _DUMMY_HASH)
+        return None
+    confere, precisa_rehash = verify_password(password, user["password"])
+    if not confere:
+        return None
+    if precisa_rehash:
+        conn = get_db_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                         (hash_password(password), user["id"], user["password"]))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            release_db_connection(conn)
+        invalidate_users_cache()
+    return user
 
 def update_user_role(user_id: int, new_role: str):
     """
@@ -262,13 +1680,17 @@ def update_user_role(user_id: int, new_role: str):
             "UPDATE users SET role = ? WHERE id = ?",
             (new_role, user_id)
         )
+        updated = cursor.rowcount > 0
+        # Sessões abertas passam a valer com o papel novo
+        cursor.execute("UPDATE sessions SET role = ? WHERE user_id = ?", (new_role, user_id))
         conn.commit()
-        return cursor.rowcount > 0
+        invalidate_users_cache()
+        return updated
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def delete_user(user_id: int):
     """
@@ -280,126 +1702,580 @@ def delete_user(user_id: int):
     try:
         conn.execute("BEGIN")
         cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        deleted = cursor.rowcount > 0
+        cursor.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
         conn.commit()
-        return cursor.rowcount > 0
+        invalidate_users_cache()
+        return deleted
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+# ---------- SESSÕES ----------
+# O login (check_user_login) acontece uma vez; depois cada rerun só confere
+# o token da sessão: assinatura HMAC (descarta tokens forjados sem ir ao
+# banco) e a sessão em memória, sem tocar em users.
+
+SESSION_TTL_S = 12 * 3600
+
+_session_secrets = {}
+
+def _session_secret():
+    segredo = _session_secrets.get(DATABASE)
+    if segredo is None:
+        conn = get_db_connection()
+        try:
+            valor = conn.execute(
+                "SELECT valor FROM segredos WHERE nome = 'session_secret'"
+            ).fetchone()[0]
+        finally:
+            release_db_connection(conn)
+        if not isinstance(valor, str):
+            raise RuntimeError("Segredo das sessões inválido no banco.")
+        segredo = _session_secrets[DATABASE] = valor.encode()
+    return segredo
+
+def _assina(aleatorio):
+    import hmac
+
+    return hmac.new(_session_secret(), aleatorio.encode(), hashlib.sha256).hexdigest()[:32]
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def create_session(user, ttl=SESSION_TTL_S):
+    """Abre uma sessão para o usuário (já autenticado) e retorna o token."""
+    import secrets
+
+    aleatorio = secrets.token_urlsafe(24)
+    token = f"{aleatorio}.{_assina(aleatorio)}"
+    agora = datetime.now()
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # Aproveita para descartar as vencidas
+        conn.execute("DELETE FROM sessions WHERE expira_em < ?", (agora.isoformat(),))
+        conn.execute(
+            "INSERT INTO sessions (token_hash, user_id, username, role, criada_em, expira_em) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (_token_hash(token), user["id"], user["username"], user["role"],
+             agora.isoformat(), (agora + timedelta(seconds=ttl)).isoformat())
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+    return token
+
+def get_session(token):
+    """
+    {"user_id", "username", "role", "expira_em"} da sessão do token, ou None
+    se ele for inválido, tiver expirado ou a sessão tiver sido encerrada.
+    """
+    import hmac
+
+    if not token or "." not in token:
+        return None
+    aleatorio, assinatura = token.rsplit(".", 1)
+    if not hmac.compare_digest(_assina(aleatorio), assinatura):
+        return None
+    chave = _token_hash(token)
+
+    def load():
+        conn = get_db_connection()
+        try:
+            row = conn.execute(
+                "SELECT user_id, username, role, expira_em FROM sessions WHERE token_hash = ?",
+                (chave,)
+            ).fetchone()
+            return dict(row) if row else None
+        finally:
+            release_db_connection(conn)
+
+    sessao = _sessions_cache.get_or_load(("session", chave), load)
+    if not sessao or sessao["expira_em"] < datetime.now().isoformat():
+        return None
+    return sessao
+
+def delete_session(token):
+    if not token:
+        return
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM sessions WHERE token_hash = ?", (_token_hash(token),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+    _sessions_cache.invalidate()
 
 # ---------- CSV / PDF ----------
 
+EXPORT_CHUNK_ROWS = 1000
+
+def iter_produtos_csv(chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Gera o CSV de produtos (separado por ';') em pedaços de texto, lendo o
+    cursor em blocos com fetchmany. A tabela nunca é carregada inteira.
+    Sem produtos, não gera nada.
+    """
+    import csv
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute("SELECT * FROM produtos ORDER BY nome ASC")
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=";", lineterminator="\r\n")
+        header = [d[0] for d in cursor.description]
+        first = True
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            if first:
+                writer.writerow(header)
+                first = False
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    finally:
+        release_db_connection(conn)
+
 def export_produtos_to_csv_content():
-    produtos = get_all_produtos()
-    if not produtos:
-        return ""
-    fieldnames = list(produtos[0].keys())
-    buffer = io.StringIO()
-    writer = csv.DictWriter(
-        buffer,
-        fieldnames=fieldnames,
-        extrasaction="ignore",
-        delimiter=";"
-    )
-    writer.writeheader()
-    writer.writerows(produtos)
-    return buffer.getvalue()
+    return "".join(iter_produtos_csv())
+
+# Colunas de produtos aceitas na importação (id é tratado à parte)
+PRODUTO_COLUNAS = (
+    "nome", "preco", "quantidade", "marca", "estilo", "tipo",
+    "foto", "data_validade", "vendido", "data_ultima_venda",
+)
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_ERRORS = 200
+# A partir de quantas linhas compensa reconstruir o FTS no fim em vez de
+# atualizá-lo linha a linha pelos triggers
+IMPORT_FTS_REBUILD_ROWS = 20000
+
+def _parse_number(value, conv):
+    """Converte número aceitando vírgula decimal; vazio vale 0, inválido levanta ValueError."""
+    value = (value or "").strip()
+    if not value:
+        return conv(0)
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    return conv(float(value)) if conv is int else conv(value)
+
+def _parse_import_row(row):
+    nome = (row.get("nome") or "").strip()
+    if not nome:
+        raise ValueError("nome vazio")
+    try:
+        preco = _parse_number(row.get("preco"), float)
+    except ValueError:
+        raise ValueError(f"preço inválido: {row.get('preco')!r}")
+    try:
+        quantidade = _parse_number(row.get("quantidade"), int)
+    except ValueError:
+        raise ValueError(f"quantidade inválida: {row.get('quantidade')!r}")
+    valores = {
+        "nome": nome,
+        "preco": preco,
+        "quantidade": quantidade,
+        "vendido": safe_int(row.get("vendido") or 0),
+    }
+    for campo in ("marca", "estilo", "tipo", "foto", "data_ultima_venda"):
+        valores[campo] = row.get(campo) or None
+    try:
+        valores["data_validade"] = normalize_date(row.get("data_validade"))
+    except ValueError:
+        raise ValueError(f"data de validade inválida: {row.get('data_validade')!r}")
+    return valores
+
+def _flush_import_chunk(cursor, chunk, colunas, upsert, result):
+    """Grava um bloco de linhas já validadas: UPDATE dos existentes, INSERT dos novos."""
+    existentes = {}
+    if upsert == "id":
+        ids = [v["id"] for v in chunk if v.get("id")]
+        if ids:
+            marks = ",".join("?" * len(ids))
+            existentes = {r[0]: r[0] for r in cursor.execute(
+                f"SELECT id FROM produtos WHERE id IN ({marks})", ids
+            ).fetchall()}
+        chave = lambda v: v.get("id")
+    elif upsert == "nome_marca":
+        nomes = sorted({v["nome"] for v in chunk})
+        marks = ",".join("?" * len(nomes))
+        for r in cursor.execute(
+            f"SELECT id, nome, marca FROM produtos WHERE nome IN ({marks}) ORDER BY id", nomes
+        ).fetchall():
+            # Produtos repetidos no banco: só o de menor id é atualizado
+            existentes.setdefault((r["nome"], r["marca"]), r["id"])
+        chave = lambda v: (v["nome"], v["marca"])
+    else:
+        chave = lambda v: None
+
+    novos, alterados = [], []
+    for v in chunk:
+        pid = existentes.get(chave(v))
+        if pid is not None:
+            alterados.append(tuple(v[c] for c in colunas) + (pid,))
+        else:
+            novos.append(v)
+
+    if alterados:
+        sets = ", ".join(f"{c} = ?" for c in colunas)
+        cursor.executemany(f"UPDATE produtos SET {sets} WHERE id = ?", alterados)
+        result["updated"] += len(alterados)
+    if novos:
+        # id do arquivo só é reaproveitado no modo upsert por id
+        com_id = upsert == "id"
+        cols = (("id",) if com_id else ()) + PRODUTO_COLUNAS
+        marks = ",".join("?" * (len(cols) + 1))
+        cursor.executemany(
+            f"INSERT INTO produtos ({', '.join(cols)}, quantidade_inicial) VALUES ({marks})",
+            [tuple(v.get(c) for c in cols) + (v.get("quantidade"),) for v in novos]
+        )
+        result["inserted"] += len(novos)
 
-def import_produtos_from_csv_buffer(file_buffer):
+def import_produtos_from_csv_buffer(file_buffer, upsert=None, chunk_size=IMPORT_CHUNK_SIZE,
+                                    progresso=None):
+    """
+    Importa produtos de um CSV (separado por ';') lendo o arquivo aos poucos
+    e gravando em blocos com executemany, tudo numa transação.
+
+    upsert:
+      None          -> sempre insere (comportamento original)
+      "id"          -> atualiza o produto com o mesmo id, insere os demais
+      "nome_marca"  -> atualiza o produto com o mesmo (nome, marca); se
+                       houver mais de um no banco, só o de menor id
+
+    progresso: função chamada com a fração do arquivo já lida (0 a 1) a
+    cada bloco gravado.
+
+    Retorna {"inserted", "updated", "skipped", "errors": [(linha, motivo)]}.
+    """
+    if upsert not in (None, "id", "nome_marca"):
+        raise ValueError(f"Modo de importação inválido: {upsert}")
+    import csv
+
+    result = {"inserted": 0, "updated": 0, "skipped": 0, "errors": []}
+    tamanho = file_buffer.seek(0, io.SEEK_END) if progresso else 0
+    file_buffer.seek(0)
+    text = io.TextIOWrapper(file_buffer, encoding="utf-8-sig", newline="")
     conn = get_db_connection()
     cursor = conn.cursor()
-    count = 0
     try:
-        conn.execute("BEGIN")
-        content = file_buffer.getvalue().decode("utf-8")
-        reader = csv.DictReader(io.StringIO(content), delimiter=";")
-        for row in reader:
-            nome = row.get("nome")
-            if not nome:
+        reader = csv.DictReader(text, delimiter=";")
+        header = [c.strip() for c in (reader.fieldnames or [])]
+        reader.fieldnames = header
+        # Numa atualização, só as colunas presentes no arquivo são sobrescritas
+        colunas = tuple(c for c in PRODUTO_COLUNAS if c in header)
+        conn.execute("BEGIN IMMEDIATE")
+        chunk, pendentes = [], {}
+        gravadas, fts_suspenso = 0, False
+        for linha, row in enumerate(reader, start=2):
+            try:
+                valores = _parse_import_row(row)
+                if upsert == "id":
+                    valores["id"] = safe_int(row.get("id"), None)
+            except ValueError as e:
+                result["skipped"] += 1
+                if len(result["errors"]) < IMPORT_MAX_ERRORS:
+                    result["errors"].append((linha, str(e)))
                 continue
-            preco = safe_float(row.get("preco", "0"))
-            quantidade = safe_int(row.get("quantidade", "0"))
-            cursor.execute("""
-                INSERT INTO produtos (
-                    nome, preco, quantidade, marca, estilo, tipo,
-                    foto, data_validade, vendido, data_ultima_venda
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                nome, preco, quantidade,
-                row.get("marca"), row.get("estilo"), row.get("tipo"),
-                row.get("foto"), row.get("data_validade"),
-                safe_int(row.get("vendido", "0")),
-                row.get("data_ultima_venda")
+            if upsert:
+                # Chave repetida dentro do mesmo bloco: vale a última linha
+                key = valores.get("id") if upsert == "id" else (valores["nome"], valores["marca"])
+                if key is not None and key in pendentes:
+                    chunk[pendentes[key]] = valores
+                    result["updated"] += 1
+                    continue
+                if key is not None:
+                    pendentes[key] = len(chunk)
+            chunk.append(valores)
+            if len(chunk) >= chunk_size:
+                gravadas += len(chunk)
+                if not fts_suspenso and gravadas >= IMPORT_FTS_REBUILD_ROWS:
+                    _suspend_fts_sync(cursor)
+                    fts_suspenso = True
+                _flush_import_chunk(cursor, chunk, colunas, upsert, result)
+                chunk, pendentes = [], {}
+                if progresso and tamanho:
+                    progresso(min(file_buffer.tell() / tamanho, 1.0))
+        if chunk:
+            _flush_import_chunk(cursor, chunk, colunas, upsert, result)
+        if fts_suspenso:
+            _resume_fts_sync(cursor)
+        if result["inserted"] or result["updated"]:
+            _bump_produtos_version(cursor)
+        conn.commit()
+        invalidate_produtos_cache()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+        # Devolve o buffer original sem fechá-lo junto com o wrapper de texto
+        text.detach()
+
+# ---------- XLSX / PARQUET ----------
+
+def _read_produtos_frame():
+    import pandas as pd
+
+    conn = get_db_connection()
+    try:
+        return pd.read_sql_query("SELECT * FROM produtos ORDER BY nome ASC", conn)
+    finally:
+        release_db_connection(conn)
+
+def write_produtos_xlsx(destino):
+    """Grava os produtos em XLSX direto em destino (caminho ou arquivo binário)."""
+    _read_produtos_frame().to_excel(destino, index=False, sheet_name="produtos", engine="openpyxl")
+
+def write_produtos_parquet(destino):
+    """Grava os produtos em Parquet direto em destino (caminho ou arquivo binário)."""
+    _read_produtos_frame().to_parquet(destino, index=False)
+
+def _to_number(series):
+    """Converte uma coluna inteira para número, aceitando vírgula decimal."""
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype("float64")
+    texto = series.astype("string").str.strip()
+    com_virgula = texto.str.contains(",", regex=False).fillna(False)
+    texto = texto.where(
+        ~com_virgula,
+        texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    )
+    return pd.to_numeric(texto, errors="coerce")
+
+def _to_iso_date(series):
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        datas = series
+    else:
+        # ISO (AAAA-MM-DD) primeiro; o que sobrar é lido como data brasileira
+        texto = series.astype("string").str.strip()
+        datas = pd.to_datetime(texto, errors="coerce", format="ISO8601")
+        resto = datas.isna() & texto.notna()
+        if resto.any():
+            datas = datas.where(~resto, pd.to_datetime(
+                texto[resto], errors="coerce", dayfirst=True, format="mixed"
             ))
-            count += 1
+    return datas.dt.strftime("%Y-%m-%d")
+
+def _coerce_produtos_frame(df):
+    """
+    Valida e converte as colunas de uma planilha de uma vez só (sem laço
+    por linha). Retorna (frame_limpo, erros) com erros = [(linha, motivo)];
+    as linhas com erro ficam fora do frame.
+    """
+    import pandas as pd
+
+    df = df.rename(columns=lambda c: str(c).strip().lower())
+    if "nome" not in df.columns:
+        raise ValueError("A planilha precisa de uma coluna 'nome'.")
+    df = df.reset_index(drop=True)
+    motivo = pd.Series(pd.NA, index=df.index, dtype="string")
+
+    def vazio(col):
+        return df[col].isna() | (df[col].astype("string").str.strip() == "")
+
+    out = pd.DataFrame(index=df.index)
+    out["nome"] = df["nome"].astype("string").str.strip()
+    motivo = motivo.mask(vazio("nome") & motivo.isna(), "nome vazio")
+
+    for col, rotulo in (("preco", "preço inválido"), ("quantidade", "quantidade inválida")):
+        if col in df.columns:
+            num = _to_number(df[col])
+            motivo = motivo.mask(num.isna() & ~vazio(col) & motivo.isna(), rotulo)
+            out[col] = num.fillna(0)
+        else:
+            out[col] = 0.0
+    out["quantidade"] = out["quantidade"].astype("float64").astype("int64")
+    out["vendido"] = _to_number(df["vendido"]).fillna(0).astype("int64") if "vendido" in df.columns else 0
+
+    if "data_validade" in df.columns:
+        datas = _to_iso_date(df["data_validade"])
+        motivo = motivo.mask(datas.isna() & ~vazio("data_validade") & motivo.isna(),
+                             "data de validade inválida")
+        out["data_validade"] = datas
+    else:
+        out["data_validade"] = None
+
+    for col in ("marca", "estilo", "tipo", "foto", "data_ultima_venda"):
+        out[col] = df[col].astype("string").str.strip().replace("", pd.NA) if col in df.columns else None
+    if "id" in df.columns:
+        out["id"] = _to_number(df["id"]).astype("Int64")
+
+    ruins = motivo.notna()
+    # Linha 1 da planilha é o cabeçalho
+    erros = [(int(i) + 2, str(m)) for i, m in motivo[ruins].items()]
+    return out[~ruins], erros
+
+def _column_values(series):
+    return series.astype(object).where(series.notna(), None).tolist()
+
+STAGE_TIPOS = {
+    "id": "INTEGER", "nome": "TEXT", "preco": "REAL", "quantidade": "INTEGER",
+    "marca": "TEXT", "estilo": "TEXT", "tipo": "TEXT", "foto": "TEXT",
+    "data_validade": "TEXT", "vendido": "INTEGER", "data_ultima_venda": "TEXT",
+}
+
+def import_produtos_from_dataframe(df, upsert=None):
+    """
+    Carga em massa a partir de um DataFrame: valida tudo vetorizado, copia
+    para uma tabela temporária e grava em produtos com um único
+    INSERT ... SELECT (mais um UPDATE ... FROM nos modos upsert).
+    Modos e retorno iguais aos de import_produtos_from_csv_buffer.
+    """
+    import pandas as pd
+
+    if upsert not in (None, "id", "nome_marca"):
+        raise ValueError(f"Modo de importação inválido: {upsert}")
+    limpo, erros = _coerce_produtos_frame(df)
+    result = {"inserted": 0, "updated": 0, "skipped": len(erros),
+              "errors": erros[:IMPORT_MAX_ERRORS]}
+    if upsert == "id" and "id" not in limpo.columns:
+        raise ValueError("Modo 'Atualizar pelo ID' exige uma coluna 'id'.")
+    # Chave repetida na planilha: vale a última linha
+    antes = len(limpo)
+    if upsert == "nome_marca":
+        limpo = limpo.drop_duplicates(["nome", "marca"], keep="last")
+    elif upsert == "id":
+        limpo = pd.concat([
+            limpo[limpo["id"].isna()],
+            limpo[limpo["id"].notna()].drop_duplicates("id", keep="last"),
+        ])
+    result["updated"] += antes - len(limpo)
+    if limpo.empty:
+        return result
+
+    cols = (("id",) if upsert == "id" else ()) + PRODUTO_COLUNAS
+    colunas_arquivo = {str(c).strip().lower() for c in df.columns}
+    # Numa atualização, só as colunas presentes na planilha são sobrescritas
+    atualizar = [c for c in PRODUTO_COLUNAS if c in colunas_arquivo]
+    valores = list(zip(*(_column_values(limpo[c]) if c in limpo.columns else [None] * len(limpo)
+                         for c in cols)))
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor.execute("DROP TABLE IF EXISTS temp.stage_produtos")
+        cursor.execute(
+            "CREATE TEMP TABLE stage_produtos ("
+            + ", ".join(f"{c} {STAGE_TIPOS[c]}" for c in cols) + ")"
+        )
+        marks = ",".join("?" * len(cols))
+        cursor.executemany(f"INSERT INTO stage_produtos ({', '.join(cols)}) VALUES ({marks})", valores)
+
+        fts_suspenso = len(valores) >= IMPORT_FTS_REBUILD_ROWS
+        if fts_suspenso:
+            _suspend_fts_sync(cursor)
+
+        if upsert:
+            if upsert == "id":
+                cond = alvo = "produtos.id = s.id"
+            else:
+                cond = "produtos.nome = s.nome AND produtos.marca IS s.marca"
+                # Mesma regra da importação por CSV: com (nome, marca)
+                # repetido no banco, só o de menor id é atualizado
+                alvo = ("produtos.id = (SELECT MIN(p.id) FROM produtos p "
+                        "WHERE p.nome = s.nome AND p.marca IS s.marca)")
+            sets = ", ".join(f"{c} = s.{c}" for c in atualizar)
+            cursor.execute(f"UPDATE produtos SET {sets} FROM stage_produtos s WHERE {alvo}")
+            result["updated"] += max(cursor.rowcount, 0)
+            novos = f"WHERE NOT EXISTS (SELECT 1 FROM produtos WHERE {cond})"
+        else:
+            novos = ""
+        lista = ", ".join(cols)
+        cursor.execute(
+            f"INSERT INTO produtos ({lista}, quantidade_inicial) "
+            f"SELECT {', '.join('s.' + c for c in cols)}, s.quantidade "
+            f"FROM stage_produtos s {novos}"
+        )
+        result["inserted"] += max(cursor.rowcount, 0)
+
+        if fts_suspenso:
+            _resume_fts_sync(cursor)
+        cursor.execute("DROP TABLE temp.stage_produtos")
+        if result["inserted"] or result["updated"]:
+            _bump_produtos_version(cursor)
         conn.commit()
-        return count
+        invalidate_produtos_cache()
+        return result
     except Exception:
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-def generate_stock_pdf_bytes():
-    produtos = get_all_produtos(include_sold=False)
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    width, height = A4
-    y = height - 50
-
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(cm, y, "Relatório de Estoque Ativo - Cores e Fragrâncias")
-    y -= 20
-
-    c.setFont("Helvetica", 10)
-    c.drawString(cm, y, f"Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
-    y -= 20
-
-    c.setFont("Helvetica-Bold", 10)
-    cols = [cm, cm*6, cm*11, cm*13, cm*15, cm*17.5]
-    headers = ["Nome", "Marca", "Tipo", "Qtd", "Preço", "Validade"]
-    for i, h in enumerate(headers):
-        c.drawString(cols[i], y, h)
-    y -= 5
-    c.line(cm, y, width - cm, y)
-    y -= 15
-
-    c.setFont("Helvetica", 9)
-    total = 0.0
-    for p in produtos:
-        if y < 40:
-            c.showPage()
-            y = height - 50
-        nome = p.get("nome", "-")[:30]
-        marca = p.get("marca", "-")[:20]
-        tipo = p.get("tipo", "-")[:20]
-        qtd = safe_int(p.get("quantidade", 0))
-        preco = safe_float(p.get("preco", 0.0))
-        total += preco * qtd
-        validade = p.get("data_validade") or "-"
-        try:
-            if validade != "-":
-                validade = datetime.fromisoformat(validade).strftime("%d/%m/%Y")
-        except Exception:
-            pass
-        preco_txt = f"R$ {preco:_.2f}".replace(".", "X").replace("_", ".").replace("X", ",")
-
-        c.drawString(cols[0], y, nome)
-        c.drawString(cols[1], y, marca)
-        c.drawString(cols[2], y, tipo)
-        c.drawString(cols[3], y, str(qtd))
-        c.drawString(cols[4], y, preco_txt)
-        c.drawString(cols[5], y, validade)
-        y -= 15
-
-    y -= 10
-    total_txt = f"R$ {total:_.2f}".replace(".", "X").replace("_", ".").replace("X", ",")
-    c.line(cm, y, width - cm, y)
-    y -= 15
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(cm, y, f"VALOR TOTAL DO ESTOQUE ATIVO: {total_txt}")
-    c.save()
-    buf.seek(0)
-    return buf.getvalue()
+def _excel_engine():
+    # calamine (Rust) lê planilhas grandes bem mais rápido; openpyxl é o padrão
+    try:
+        import python_calamine  # noqa: F401
+        return "calamine"
+    except ImportError:
+        return "openpyxl"
+
+def import_produtos_from_xlsx(file_buffer, upsert=None):
+    import pandas as pd
+
+    df = pd.read_excel(file_buffer, dtype=object, engine=_excel_engine())
+    return import_produtos_from_dataframe(df, upsert=upsert)
+
+def import_produtos_from_parquet(file_buffer, upsert=None):
+    import pandas as pd
+
+    return import_produtos_from_dataframe(pd.read_parquet(file_buffer), upsert=upsert)
+
+def generate_stock_pdf_bytes(group_by=None, pages=None):
+    """
+    Relatório PDF do estoque ativo em bytes. A montagem (em arquivo
+    temporário, lendo o banco aos poucos) fica em utils/relatorios.py.
+    """
+    from utils.relatorios import generate_stock_pdf
+
+    path = generate_stock_pdf(group_by=group_by, pages=pages)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+# ---------- INSTRUMENTAÇÃO ----------
+# Toda função pública deste módulo registra duração e linhas retornadas no
+# buffer de utils/instrumentacao.py. Chamadas internas (ex.:
+# get_produtos_summary -> get_inventory_valuation) aparecem separadas.
+
+_NAO_INSTRUMENTAR = {
+    "safe_int", "safe_float", "normalize_date", "hash_password", "verify_password",
+    "get_db_connection", "release_db_connection", "close_all_connections",
+    "invalidate_produtos_cache", "invalidate_users_cache",
+}
+
+# Flag de code.co_flags das funções geradoras (inspect.CO_GENERATOR); o
+# próprio inspect não é importado por ser caro no import deste módulo
+_CO_GENERATOR = 0x20
+
+def _instrumenta_modulo():
+    for nome, obj in list(globals().items()):
+        if (nome.startswith("_") or nome in _NAO_INSTRUMENTAR
+                or not isinstance(obj, types.FunctionType) or obj.__module__ != __name__
+                or obj.__code__.co_flags & _CO_GENERATOR):
+            continue
+        globals()[nome] = instrumentar(obj)
+
+_instrumenta_modulo()
@@ -0,0 +1,242 @@
+# utils/instrumentacao.py
+
+import os
+import io
+import time
+import threading
+import functools
+import itertools
+from collections import deque
+
+# Desligue com ESTOQUE_INSTRUMENTACAO=0 (as funções do banco deixam de ser
+# embrulhadas e o custo vai a zero).
+ATIVA = os.environ.get("ESTOQUE_INSTRUMENTACAO", "1") != "0"
+
+# Eventos mais antigos são descartados quando o buffer enche
+RING_SIZE = 5000
+MAX_PERFIS = 10
+PERFIL_LINHAS = 40
+
+_eventos = deque(maxlen=RING_SIZE)
+_perfis = deque(maxlen=MAX_PERFIS)
+_local = threading.local()
+_reruns = itertools.count(1)
+_lock = threading.Lock()
+_perfis_pendentes = 0
+conexoes_abertas = 0
+
+
+def _registra(tipo, nome, ms, **extra):
+    rerun = getattr(_local, "rerun", None)
+    evento = {
+        "ts": time.time(),
+        "tipo": tipo,
+        "nome": nome,
+        "ms": round(ms, 3),
+        "pagina": rerun.pagina if rerun else None,
+        "rerun": rerun.id if rerun else None,
+    }
+    evento.update(extra)
+    _eventos.append(evento)
+    if rerun:
+        if tipo == "db":
+            rerun.chamadas += 1
+        elif tipo == "conexao" and extra.get("nova"):
+            rerun.conexoes += 1
+
+
+def _linhas(resultado):
+    if isinstance(resultado, (list, tuple)):
+        return len(resultado)
+    if isinstance(resultado, dict):
+        return 1
+    return 0 if resultado is None else None
+
+
+def instrumentar(fn, tipo="db"):
+    """Embrulha fn registrando duração e número de linhas de cada chamada."""
+    if not ATIVA:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        inicio = time.perf_counter()
+        erro = None
+        resultado = None
+        try:
+            resultado = fn(*args, **kwargs)
+            return resultado
+        except BaseException as e:
+            erro = type(e).__name__
+            raise
+        finally:
+            _registra(tipo, fn.__name__, (time.perf_counter() - inicio) * 1000,
+                      linhas=_linhas(resultado), erro=erro)
+
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+
+def registra_conexao(ms, nova):
+    """Chamado pelo pool a cada conexão emprestada (nova = aberta agora)."""
+    global conexoes_abertas
+    if nova:
+        with _lock:
+            conexoes_abertas += 1
+    if ATIVA:
+        _registra("conexao", "get_db_connection", ms, nova=nova)
+
+
+# ---------- PÁGINAS ----------
+
+class _Rerun:
+    """
+    Marcações de tempo de uma execução de página. secao() fecha a seção
+    anterior e abre a próxima; fim() fecha a última e registra o total.
+    Chame fim() antes de st.stop(), que interrompe o script.
+    """
+
+    def __init__(self, pagina):
+        global _perfis_pendentes
+        self.pagina = pagina
+        self.id = next(_reruns)
+        self.inicio = self._marca = time.perf_counter()
+        self._secao = None
+        self.chamadas = 0
+        self.conexoes = 0
+        self._perfil = None
+        self._fechado = False
+        with _lock:
+            capturar = _perfis_pendentes > 0
+            if capturar:
+                _perfis_pendentes -= 1
+        if capturar:
+            import cProfile
+            self._perfil = cProfile.Profile()
+            self._perfil.enable()
+
+    def _fecha_secao(self):
+        agora = time.perf_counter()
+        if self._secao:
+            _registra("secao", self._secao, (agora - self._marca) * 1000)
+        self._marca = agora
+
+    def secao(self, nome):
+        if ATIVA and not self._fechado:
+            self._fecha_secao()
+            self._secao = nome
+
+    def fim(self):
+        if self._fechado:
+            return
+        self._fechado = True
+        if self._perfil:
+            self._perfil.disable()
+            _guarda_perfil(self)
+        if ATIVA:
+            self._fecha_secao()
+            _registra("pagina", self.pagina, (time.perf_counter() - self.inicio) * 1000,
+                      chamadas=self.chamadas, conexoes=self.conexoes)
+        if getattr(_local, "rerun", None) is self:
+            _local.rerun = None
+
+
+def rerun_atual():
+    """Medição de página em andamento nesta thread (ou None)."""
+    return getattr(_local, "rerun", None)
+
+
+def pagina(nome):
+    """Inicia a medição de uma execução da página (uma por rerun)."""
+    anterior = getattr(_local, "rerun", None)
+    if anterior:
+        # Rerun anterior nesta thread terminou sem fim() (ex.: exceção)
+        anterior.fim()
+    rerun = _Rerun(nome)
+    _local.rerun = rerun
+    return rerun
+
+
+# ---------- PERFIS (cProfile) ----------
+
+def capturar_perfis(quantidade=1):
+    """Liga o cProfile nas próximas `quantidade` execuções de página."""
+    global _perfis_pendentes
+    with _lock:
+        _perfis_pendentes = max(int(quantidade), 0)
+
+
+def _guarda_perfil(rerun):
+    import pstats
+
+    saida = io.StringIO()
+    stats = pstats.Stats(rerun._perfil, stream=saida)
+    stats.sort_stats("cumulative").print_stats(PERFIL_LINHAS)
+    _perfis.append({
+        "ts": time.time(),
+        "pagina": rerun.pagina,
+        "rerun": rerun.id,
+        "ms": round((time.perf_counter() - rerun.inicio) * 1000, 3),
+        "texto": saida.getvalue(),
+    })
+
+
+def get_perfis():
+    return list(_perfis)
+
+
+# ---------- CONSULTA ----------
+
+def get_eventos(tipo=None):
+    eventos = list(_eventos)
+    if tipo:
+        eventos = [e for e in eventos if e["tipo"] == tipo]
+    return eventos
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    if not valores:
+        return None
+    k = (len(valores) - 1) * p / 100
+    baixo = int(k)
+    alto = min(baixo + 1, len(valores) - 1)
+    return valores[baixo] + (valores[alto] - valores[baixo]) * (k - baixo)
+
+
+def resumo(tipo, chave="nome"):
+    """
+    Agrega os eventos de um tipo por `chave`:
+    [{chave, "n", "p50_ms", "p95_ms", "max_ms", "linhas"}], mais lentos (p95) primeiro.
+    """
+    grupos = {}
+    for e in get_eventos(tipo):
+        grupos.setdefault(e[chave], []).append(e)
+    linhas = []
+    for nome, eventos in grupos.items():
+        tempos = [e["ms"] for e in eventos]
+        linhas.append({
+            chave: nome,
+            "n": len(eventos),
+            "p50_ms": round(_percentil(tempos, 50), 3),
+            "p95_ms": round(_percentil(tempos, 95), 3),
+            "max_ms": max(tempos),
+            "linhas": sum(e.get("linhas") or 0 for e in eventos),
+        })
+    linhas.sort(key=lambda l: l["p95_ms"], reverse=True)
+    return linhas
+
+
+def mais_lentas(n=20, tipo="db"):
+    return sorted(get_eventos(tipo), key=lambda e: e["ms"], reverse=True)[:n]
+
+
+def exportar_jsonl():
+    import json
+
+    return "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in get_eventos())
+
+
+def limpar():
+    _eventos.clear()
+    _perfis.clear()
@@ -0,0 +1,240 @@
+# utils/relatorios.py
+
+import os
+import re
+import tempfile
+from datetime import datetime
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from utils.database import (
+    get_db_connection, release_db_connection, get_inventory_valuation, safe_int, safe_float
+)
+
+TITULO = "Relatório de Estoque Ativo - Cores e Fragrâncias"
+CABECALHO = ["Nome", "Marca", "Tipo", "Qtd", "Preço", "Total", "Validade"]
+LARGURAS = [4.6 * cm, 3.2 * cm, 3.4 * cm, 1.2 * cm, 2.2 * cm, 2.3 * cm, 2.1 * cm]
+# Limite de caracteres por coluna de texto (Nome, Marca, Tipo)
+MAX_CHARS = (26, 18, 22)
+
+ROW_H = 14
+TOPO = 50          # margem superior
+RODAPE = 40        # margem inferior (número da página fica abaixo dela)
+TITULO_H = 40      # espaço do título na primeira página
+FETCH_ROWS = 500
+
+AGRUPAMENTOS = ("marca", "tipo")
+
+_SEM_GRUPO = object()
+
+_BRL = str.maketrans(",.", ".,")
+_ISO_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+
+# Colunas numéricas (Qtd, Preço, Total) são alinhadas à direita
+_DIREITA = {3, 4, 5}
+_X = [cm + sum(LARGURAS[:i]) for i in range(len(LARGURAS))]
+PADDING = 3
+
+
+def format_brl(valor):
+    return f"R$ {valor:,.2f}".translate(_BRL)
+
+
+def _format_date(valor):
+    if not valor:
+        return "-"
+    m = _ISO_DATE.match(valor)
+    return f"{m.group(3)}/{m.group(2)}/{m.group(1)}" if m else valor
+
+
+class _PaginaTabela:
+    """
+    Acumula as linhas da página atual e desenha a página inteira de uma vez,
+    como um bloco de tabela com o cabeçalho repetido: um único objeto de
+    texto mais as linhas de grade. Páginas fora do intervalo pedido são
+    paginadas normalmente, mas não desenhadas.
+    """
+
+    def __init__(self, destino, paginas=None):
+        self.c = canvas.Canvas(destino, pagesize=A4, pageCompression=1)
+        self.width, self.height = A4
+        self.primeira, self.ultima = paginas or (1, None)
+        self.pagina = 1
+        self.linhas = []
+        self._novo_topo()
+
+    def _visivel(self):
+        return self.pagina >= self.primeira and (self.ultima is None or self.pagina <= self.ultima)
+
+    @property
+    def terminou(self):
+        return self.ultima is not None and self.pagina > self.ultima
+
+    @property
+    def restantes(self):
+        return self.capacidade - len(self.linhas)
+
+    def _novo_topo(self):
+        topo = self.height - TOPO
+        if self.pagina == 1:
+            if self._visivel():
+                self.c.setFont("Helvetica-Bold", 16)
+                self.c.drawString(cm, topo, TITULO)
+                self.c.setFont("Helvetica", 10)
+                self.c.drawString(cm, topo - 20,
+                                  f"Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+            topo -= TITULO_H
+        # -1 por causa da linha de cabeçalho da tabela
+        self.capacidade = int((topo - RODAPE) // ROW_H) - 1
+        self.topo = topo
+
+    def add(self, celulas, tipo=None):
+        """tipo: None (produto), "grupo", "subtotal" ou "total"."""
+        if len(self.linhas) >= self.capacidade:
+            self.quebra()
+        self.linhas.append((celulas, tipo))
+
+    def _desenha(self):
+        c = self.c
+        texto = c.beginText()
+        y = self.topo - ROW_H + 4
+        fonte_atual = None
+        for celulas, tipo in [(CABECALHO, "cabecalho")] + self.linhas:
+            fonte = ("Helvetica", 8.5) if tipo is None else ("Helvetica-Bold", 10 if tipo == "total" else 9)
+            if fonte != fonte_atual:
+                texto.setFont(*fonte)
+                fonte_atual = fonte
+            if tipo == "grupo":
+                c.setFillColor(colors.whitesmoke)
+                c.rect(cm, y - 4, sum(LARGURAS), ROW_H, stroke=0, fill=1)
+                c.setFillColor(colors.black)
+            if tipo in ("subtotal", "total"):
+                c.setStrokeColor(colors.grey if tipo == "subtotal" else colors.black)
+                c.line(cm, y + ROW_H - 4, cm + sum(LARGURAS), y + ROW_H - 4)
+            for i, valor in enumerate(celulas):
+                if not valor:
+                    continue
+                if i in _DIREITA and tipo != "total":
+                    x = _X[i] + LARGURAS[i] - PADDING - stringWidth(valor, *fonte)
+                else:
+                    x = _X[i] + PADDING
+                texto.setTextOrigin(x, y)
+                texto.textOut(valor)
+            y -= ROW_H
+        c.drawText(texto)
+        c.setStrokeColor(colors.black)
+        c.setLineWidth(0.8)
+        c.line(cm, self.topo - ROW_H, cm + sum(LARGURAS), self.topo - ROW_H)
+        c.setFont("Helvetica", 8)
+        c.drawRightString(self.width - cm, RODAPE / 2, f"Página {self.pagina}")
+        c.showPage()
+
+    def quebra(self):
+        if self._visivel():
+            self._desenha()
+        self.linhas = []
+        self.pagina += 1
+        if not self.terminou:
+            self._novo_topo()
+
+    def save(self):
+        if self.linhas or self.pagina == 1:
+            self.quebra()
+        self.c.save()
+
+
+def _iter_estoque(group_by, include_sold):
+    ordem = f"{group_by}, nome" if group_by else "nome"
+    where = "" if include_sold else "WHERE quantidade > 0"
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            f"SELECT nome, marca, tipo, quantidade, preco, data_validade "
+            f"FROM produtos {where} ORDER BY {ordem}"
+        )
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        release_db_connection(conn)
+
+
+def write_stock_pdf(destino, group_by=None, pages=None, include_sold=False, progresso=None):
+    """
+    Escreve o relatório de estoque em `destino` (caminho ou arquivo binário),
+    lendo os produtos do cursor em blocos.
+
+    group_by: None, "marca" ou "tipo" (seções com subtotal por grupo).
+    pages: (primeira, ultima) para gerar só esse intervalo de páginas;
+           ultima=None vai até o fim.
+    progresso: função chamada com a fração de produtos já escritos (0 a 1)
+               a cada FETCH_ROWS produtos.
+    """
+    if group_by not in (None,) + AGRUPAMENTOS:
+        raise ValueError(f"Agrupamento inválido: {group_by}")
+    doc = _PaginaTabela(destino, pages)
+    grupo_atual = _SEM_GRUPO
+    sub_qtd, sub_valor = 0, 0.0
+    total_itens = get_inventory_valuation({"include_sold": include_sold})["itens"] if progresso else 0
+    escritos = 0
+
+    def fecha_grupo():
+        doc.add([f"Subtotal {grupo_atual or '-'}"[:40], "", "", str(sub_qtd), "",
+                 format_brl(sub_valor), ""], "subtotal")
+
+    for nome, marca, tipo, qtd, preco, validade in _iter_estoque(group_by, include_sold):
+        if doc.terminou:
+            break
+        qtd = safe_int(qtd)
+        preco = safe_float(preco)
+        valor = preco * qtd
+        if group_by:
+            grupo = marca if group_by == "marca" else tipo
+            if grupo != grupo_atual:
+                if grupo_atual is not _SEM_GRUPO:
+                    fecha_grupo()
+                grupo_atual = grupo
+                sub_qtd, sub_valor = 0, 0.0
+                # Não deixa o título do grupo sozinho no pé da página
+                if doc.restantes < 2:
+                    doc.quebra()
+                doc.add([f"{group_by.title()}: {grupo or '-'}", "", "", "", "", "", ""], "grupo")
+            sub_qtd += qtd
+            sub_valor += valor
+        doc.add([
+            (nome or "-")[:MAX_CHARS[0]],
+            (marca or "-")[:MAX_CHARS[1]],
+            (tipo or "-")[:MAX_CHARS[2]],
+            str(qtd),
+            format_brl(preco),
+            format_brl(valor),
+            _format_date(validade),
+        ])
+        escritos += 1
+        if progresso and total_itens and escritos % FETCH_ROWS == 0:
+            progresso(min(escritos / total_itens, 1.0))
+
+    if not doc.terminou:
+        if grupo_atual is not _SEM_GRUPO:
+            fecha_grupo()
+        total = get_inventory_valuation({"include_sold": include_sold})["valor"]
+        doc.add([f"VALOR TOTAL DO ESTOQUE ATIVO: {format_brl(total)}", "", "", "", "", "", ""], "total")
+    doc.save()
+    return destino
+
+
+def generate_stock_pdf(group_by=None, pages=None, include_sold=False):
+    """Gera o relatório num arquivo temporário e retorna o caminho dele."""
+    fd, path = tempfile.mkstemp(prefix="estoque_", suffix=".pdf")
+    os.close(fd)
+    try:
+        return write_stock_pdf(path, group_by=group_by, pages=pages, include_sold=include_sold)
+    except Exception:
+        os.remove(path)
+        raise
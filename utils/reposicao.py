@@ -0,0 +1,160 @@
+# utils/reposicao.py
+
+import math
+from datetime import date
+
+from utils.database import (
+    get_db_connection, release_db_connection, get_produtos_version,
+    ReadCache, safe_int, safe_float
+)
+
+# Média móvel exponencial das vendas diárias: uma venda perde metade do peso
+# a cada MEIA_VIDA_DIAS dias. Mudar a meia-vida recalcula tudo na próxima
+# atualização.
+MEIA_VIDA_DIAS = 14
+_DECAIMENTO = 0.5 ** (1 / MEIA_VIDA_DIAS)
+
+# Parâmetros padrão da sugestão de compra (em dias)
+PRAZO_ENTREGA_DIAS = 7
+ESTOQUE_SEGURANCA_DIAS = 7
+COBERTURA_ALVO_DIAS = 30
+
+# Abaixo disso (unidades/dia) o produto é considerado parado
+VELOCIDADE_MINIMA = 0.01
+
+FETCH_ROWS = 5000
+
+_cache = ReadCache(32, 300.0)
+
+
+def _dias(inicio, fim):
+    return (date.fromisoformat(fim) - date.fromisoformat(inicio)).days
+
+
+def refresh_velocidades():
+    """
+    Atualiza a velocidade de cada produto com as vendas registradas desde a
+    última atualização (ids de vendas acima da marca d'água em app_meta).
+    Na primeira vez percorre o histórico inteiro; depois, só o que é novo.
+    Retorna quantas vendas foram processadas.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        meta = dict(cursor.execute(
+            "SELECT chave, valor FROM app_meta "
+            "WHERE chave IN ('velocidade_ultima_venda', 'velocidade_meia_vida')"
+        ).fetchall())
+        ultima = meta.get("velocidade_ultima_venda", 0)
+        if meta.get("velocidade_meia_vida") != MEIA_VIDA_DIAS:
+            cursor.execute("DELETE FROM vendas_velocidade")
+            ultima = 0
+
+        estado = {}
+        processadas = 0
+        vendas = cursor.execute(
+            "SELECT id, produto_id, quantidade, substr(data, 1, 10) FROM vendas "
+            "WHERE id > ? ORDER BY id", (ultima,)
+        )
+        while True:
+            bloco = vendas.fetchmany(FETCH_ROWS)
+            if not bloco:
+                break
+            novos = {pid for _, pid, _, _ in bloco if pid not in estado}
+            if novos and ultima:
+                marks = ",".join("?" * len(novos))
+                for pid, taxa, dia_ref in conn.execute(
+                    f"SELECT produto_id, taxa, dia_ref FROM vendas_velocidade "
+                    f"WHERE produto_id IN ({marks})", list(novos)
+                ).fetchall():
+                    estado[pid] = [taxa, dia_ref]
+            for venda_id, pid, qtd, dia in bloco:
+                taxa, dia_ref = estado.get(pid) or (0.0, dia)
+                passados = max(_dias(dia_ref, dia), 0)
+                estado[pid] = [taxa * _DECAIMENTO ** passados + (1 - _DECAIMENTO) * qtd,
+                               max(dia, dia_ref)]
+                ultima = venda_id
+            processadas += len(bloco)
+
+        cursor.executemany(
+            "INSERT INTO vendas_velocidade (produto_id, taxa, dia_ref) VALUES (?, ?, ?) "
+            "ON CONFLICT (produto_id) DO UPDATE SET taxa = excluded.taxa, dia_ref = excluded.dia_ref",
+            [(pid, taxa, dia_ref) for pid, (taxa, dia_ref) in estado.items()]
+        )
+        cursor.executemany(
+            "INSERT INTO app_meta (chave, valor) VALUES (?, ?) "
+            "ON CONFLICT (chave) DO UPDATE SET valor = excluded.valor",
+            [("velocidade_ultima_venda", ultima), ("velocidade_meia_vida", MEIA_VIDA_DIAS)]
+        )
+        conn.commit()
+        return processadas
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+
+def _calcula_reposicao(prazo, seguranca, cobertura):
+    hoje = date.today()
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("""
+            SELECT p.id, p.nome, p.marca, p.tipo, p.quantidade, p.preco,
+                   v.taxa, v.dia_ref
+            FROM vendas_velocidade v
+            JOIN produtos p ON p.id = v.produto_id
+        """).fetchall()
+    finally:
+        release_db_connection(conn)
+
+    grupos = {}
+    for r in rows:
+        velocidade = r["taxa"] * _DECAIMENTO ** max((hoje - date.fromisoformat(r["dia_ref"])).days, 0)
+        if velocidade < VELOCIDADE_MINIMA:
+            continue
+        qtd = safe_int(r["quantidade"])
+        ponto = velocidade * (prazo + seguranca)
+        if qtd > ponto:
+            continue
+        alvo = velocidade * (prazo + seguranca + cobertura)
+        grupos.setdefault(r["marca"] or "", []).append({
+            "id": r["id"],
+            "nome": r["nome"],
+            "marca": r["marca"],
+            "tipo": r["tipo"],
+            "quantidade": qtd,
+            "preco": safe_float(r["preco"]),
+            "velocidade": round(velocidade, 3),
+            "dias_cobertura": round(qtd / velocidade, 1),
+            "ponto_reposicao": math.ceil(ponto),
+            "sugestao": max(math.ceil(alvo) - qtd, 0),
+        })
+    for itens in grupos.values():
+        itens.sort(key=lambda i: i["dias_cobertura"])
+    # Marcas com o item mais urgente primeiro
+    return dict(sorted(grupos.items(), key=lambda g: g[1][0]["dias_cobertura"]))
+
+
+def get_reorder_list(prazo=PRAZO_ENTREGA_DIAS, seguranca=ESTOQUE_SEGURANCA_DIAS,
+                     cobertura=COBERTURA_ALVO_DIAS):
+    """
+    Produtos que chegaram ao ponto de reposição, agrupados por marca:
+    {marca: [item, ...]}, do menor para o maior número de dias de cobertura.
+
+    ponto de reposição = velocidade x (prazo + segurança)
+    sugestão de compra = velocidade x (prazo + segurança + cobertura) - estoque
+
+    O resultado fica em cache até a próxima escrita em produtos (cada venda
+    muda a versão); nessa hora só as vendas novas são processadas.
+    """
+    prazo, seguranca, cobertura = (max(safe_int(v), 0) for v in (prazo, seguranca, cobertura))
+    key = ("reposicao", get_produtos_version(), date.today().isoformat(),
+           prazo, seguranca, cobertura)
+
+    def load():
+        refresh_velocidades()
+        return _calcula_reposicao(prazo, seguranca, cobertura)
+
+    return _cache.get_or_load(key, load)
@@ -0,0 +1,298 @@
+# utils/tarefas.py
+
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from utils import database
+from utils.database import (
+    get_db_connection, release_db_connection, get_produtos_version, iter_produtos_csv,
+    write_produtos_xlsx, write_produtos_parquet, import_produtos_from_csv_buffer,
+    import_produtos_from_xlsx, import_produtos_from_parquet
+)
+
+# Tarefas executadas ao mesmo tempo por este processo; as demais esperam na fila
+MAX_WORKERS = 2
+# Tarefas (e arquivos gerados) mais antigas que isso são apagadas
+VALIDADE_DIAS = 7
+
+PENDENTE, EXECUTANDO, CONCLUIDA, ERRO = "pendente", "executando", "concluida", "erro"
+ATIVAS = (PENDENTE, EXECUTANDO)
+
+EXPORT_FORMATOS = ("csv", "xlsx", "parquet")
+IMPORT_FORMATOS = ("csv", "xlsx", "parquet")
+
+MIME = {
+    "pdf": "application/pdf",
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/octet-stream",
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+# Progresso das tarefas em andamento (0 a 1). Fica só em memória: durante
+# uma importação o banco está com o lock de escrita da própria importação.
+_progresso = {}
+_recuperados = set()
+
+
+def _agora():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _pasta():
+    """Arquivos das tarefas ficam ao lado do banco, em tarefas/."""
+    pasta = os.path.join(os.path.dirname(database.DATABASE) or ".", "tarefas")
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="tarefa")
+        return _executor
+
+
+def _chave(tipo, params, extra):
+    texto = json.dumps([tipo, params, extra], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _atualiza(tarefa_id, **campos):
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            f"UPDATE tarefas SET {', '.join(f'{c} = ?' for c in campos)} WHERE id = ?",
+            (*campos.values(), tarefa_id)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+
+def _remove(caminho):
+    try:
+        os.remove(caminho)
+    except (FileNotFoundError, TypeError):
+        pass
+
+
+def _recupera():
+    """
+    Uma vez por processo (e por banco), na primeira consulta ou envio de
+    tarefa: as que ficaram na fila ou em execução num processo anterior
+    (servidor reiniciado) são marcadas como erro, e as vencidas são apagadas
+    junto com seus arquivos.
+    """
+    if database.DATABASE in _recuperados:
+        return
+    _recuperados.add(database.DATABASE)
+    limite = (datetime.now() - timedelta(days=VALIDADE_DIAS)).isoformat(timespec="seconds")
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "UPDATE tarefas SET status = ?, erro = 'interrompida (servidor reiniciado)', "
+            "concluida_em = ? WHERE status IN (?, ?) AND pid IS NOT ?",
+            (ERRO, _agora(), *ATIVAS, os.getpid())
+        )
+        vencidas = conn.execute(
+            "SELECT id, arquivo FROM tarefas WHERE criada_em < ?", (limite,)
+        ).fetchall()
+        conn.execute("DELETE FROM tarefas WHERE criada_em < ?", (limite,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+    for row in vencidas:
+        _remove(row["arquivo"])
+
+
+# ---------- EXECUÇÃO ----------
+
+def _relatorio(tarefa_id, params, progresso):
+    from utils.relatorios import write_stock_pdf
+
+    destino = os.path.join(_pasta(), f"{tarefa_id}.pdf")
+    write_stock_pdf(f"{destino}.tmp", group_by=params.get("group_by"), progresso=progresso)
+    os.replace(f"{destino}.tmp", destino)
+    return {"arquivo": destino, "nome_arquivo": "estoque_ativo.pdf"}
+
+
+def _exportacao(tarefa_id, params, progresso):
+    formato = params["formato"]
+    destino = os.path.join(_pasta(), f"{tarefa_id}.{formato}")
+    with open(f"{destino}.tmp", "wb") as f:
+        if formato == "csv":
+            for pedaco in iter_produtos_csv():
+                f.write(pedaco.encode("utf-8"))
+        elif formato == "xlsx":
+            write_produtos_xlsx(f)
+        else:
+            write_produtos_parquet(f)
+    os.replace(f"{destino}.tmp", destino)
+    return {"arquivo": destino, "nome_arquivo": f"estoque.{formato}"}
+
+
+def _importacao(tarefa_id, params, progresso):
+    entrada = params["entrada"]
+    try:
+        with open(entrada, "rb") as f:
+            if params["formato"] == "xlsx":
+                res = import_produtos_from_xlsx(f, upsert=params.get("upsert"))
+            elif params["formato"] == "parquet":
+                res = import_produtos_from_parquet(f, upsert=params.get("upsert"))
+            else:
+                res = import_produtos_from_csv_buffer(f, upsert=params.get("upsert"),
+                                                      progresso=progresso)
+    finally:
+        _remove(entrada)
+    return {"resultado": json.dumps(res, ensure_ascii=False)}
+
+
+_EXECUTORES = {
+    "relatorio": _relatorio,
+    "exportacao": _exportacao,
+    "importacao": _importacao,
+}
+
+
+def _executa(tarefa_id):
+    tarefa = get_tarefa(tarefa_id)
+    _progresso[tarefa_id] = 0.0
+
+    def progresso(fracao):
+        _progresso[tarefa_id] = fracao
+
+    try:
+        _atualiza(tarefa_id, status=EXECUTANDO, iniciada_em=_agora())
+        campos = _EXECUTORES[tarefa["tipo"]](tarefa_id, tarefa["params"], progresso)
+        _atualiza(tarefa_id, status=CONCLUIDA, concluida_em=_agora(), **campos)
+    except Exception as e:
+        _atualiza(tarefa_id, status=ERRO, concluida_em=_agora(), erro=str(e) or type(e).__name__)
+    finally:
+        _progresso.pop(tarefa_id, None)
+
+
+# ---------- API ----------
+
+def submit_tarefa(tipo, params=None, dados=None, usuario=None):
+    """
+    Põe uma tarefa na fila e retorna o id dela; a execução acontece numa
+    thread do pool, fora do rerun da página.
+
+    tipo:
+      "relatorio"   -> PDF do estoque ativo; params {"group_by"}
+      "exportacao"  -> arquivo de produtos; params {"formato": csv|xlsx|parquet}
+      "importacao"  -> params {"formato", "upsert"}; dados = bytes do arquivo
+
+    Pedidos iguais são reaproveitados: um relatório ou exportação já pronto
+    para a mesma versão dos produtos, ou qualquer tarefa igual ainda na fila,
+    devolve o id existente.
+    """
+    if tipo not in _EXECUTORES:
+        raise ValueError(f"Tipo de tarefa inválido: {tipo}")
+    params = dict(params or {})
+    if tipo == "exportacao" and params.get("formato") not in EXPORT_FORMATOS:
+        raise ValueError(f"Formato de exportação inválido: {params.get('formato')}")
+    if tipo == "importacao":
+        if dados is None:
+            raise ValueError("Importação sem arquivo.")
+        if params.get("formato") not in IMPORT_FORMATOS:
+            raise ValueError(f"Formato de importação inválido: {params.get('formato')}")
+        # Reimportar o mesmo arquivo depois é permitido: só a fila é reaproveitada
+        chave = _chave(tipo, params, hashlib.sha256(dados).hexdigest())
+        reaproveita = ATIVAS
+    else:
+        chave = _chave(tipo, params, get_produtos_version())
+        reaproveita = ATIVAS + (CONCLUIDA,)
+    _recupera()
+
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for row in conn.execute(
+            f"SELECT id, status, arquivo FROM tarefas WHERE chave = ? "
+            f"AND status IN ({', '.join('?' * len(reaproveita))}) ORDER BY id DESC",
+            (chave, *reaproveita)
+        ).fetchall():
+            if row["status"] != CONCLUIDA or os.path.exists(row["arquivo"] or ""):
+                conn.rollback()
+                return row["id"]
+        tarefa_id = conn.execute(
+            "INSERT INTO tarefas (tipo, chave, params, usuario, pid, criada_em) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (tipo, chave, json.dumps(params, ensure_ascii=False), usuario, os.getpid(), _agora())
+        ).lastrowid
+        if dados is not None:
+            params["entrada"] = os.path.join(_pasta(), f"{tarefa_id}_entrada.{params['formato']}")
+            with open(params["entrada"], "wb") as f:
+                f.write(dados)
+            conn.execute("UPDATE tarefas SET params = ? WHERE id = ?",
+                         (json.dumps(params, ensure_ascii=False), tarefa_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+    _get_executor().submit(_executa, tarefa_id)
+    return tarefa_id
+
+
+def _tarefa_dict(row):
+    tarefa = dict(row)
+    tarefa["params"] = json.loads(tarefa["params"] or "{}")
+    tarefa["resultado"] = json.loads(tarefa["resultado"]) if tarefa["resultado"] else None
+    if tarefa["status"] == CONCLUIDA:
+        tarefa["progresso"] = 1.0
+    else:
+        tarefa["progresso"] = _progresso.get(tarefa["id"], 0.0)
+    return tarefa
+
+
+def get_tarefa(tarefa_id):
+    _recupera()
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT * FROM tarefas WHERE id = ?", (tarefa_id,)).fetchone()
+        return _tarefa_dict(row) if row else None
+    finally:
+        release_db_connection(conn)
+
+
+def list_tarefas(limit=10):
+    """
+    Tarefas mais recentes primeiro, com o progresso das que estão rodando.
+    As que ficaram presas por um processo anterior já saem como erro.
+    """
+    _recupera()
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "SELECT * FROM tarefas ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [_tarefa_dict(r) for r in rows]
+    finally:
+        release_db_connection(conn)
+
+
+def get_resultado_bytes(tarefa_id):
+    """Conteúdo do arquivo gerado pela tarefa (para o botão de download)."""
+    tarefa = get_tarefa(tarefa_id)
+    if not tarefa or tarefa["status"] != CONCLUIDA or not tarefa["arquivo"]:
+        raise ValueError("Tarefa sem arquivo para baixar.")
+    with open(tarefa["arquivo"], "rb") as f:
+        return f.read()
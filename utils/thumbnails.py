@@ -0,0 +1,109 @@
+# utils/thumbnails.py
+
+import os
+import hashlib
+import threading
+from functools import lru_cache
+
+from utils.database import ASSETS_DIR, DATABASE_DIR
+from utils.instrumentacao import instrumentar
+
+# Miniaturas ficam fora de assets/ para não se misturarem com os uploads
+THUMBS_DIR = os.path.join(DATABASE_DIR, "thumbs")
+
+# Larguras geradas (px). Os cards exibem ~120 px; 240 cobre telas de alta densidade.
+THUMB_SIZES = (240, 480)
+DEFAULT_THUMB_SIZE = 240
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+@lru_cache(maxsize=4096)
+def _content_hash(path, mtime_ns, size):
+    # mtime/tamanho entram na chave só para invalidar o cache quando o arquivo muda
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def file_content_hash(path):
+    st = os.stat(path)
+    return _content_hash(path, st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=1)
+def _thumb_format():
+    from PIL import features
+    return ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+
+
+def _thumb_path(digest, size):
+    _, ext = _thumb_format()
+    return os.path.join(THUMBS_DIR, digest[:2], f"{digest}_{size}.{ext}")
+
+
+def _render_thumbnail(src, dest, size):
+    from PIL import Image, ImageOps
+
+    fmt, _ = _thumb_format()
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size * 4))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{threading.get_ident()}.tmp"
+        if fmt == "WEBP":
+            img.save(tmp, fmt, quality=WEBP_QUALITY, method=4)
+        else:
+            img.save(tmp, fmt, quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp, dest)
+
+
+def generate_thumbnails(src, sizes=THUMB_SIZES):
+    """
+    Gera (se ainda não existirem) as miniaturas de uma foto em todos os
+    tamanhos. Chamado ao salvar uma foto nova; retorna {tamanho: caminho}.
+    """
+    digest = file_content_hash(src)
+    gerados = {}
+    for size in sizes:
+        dest = _thumb_path(digest, size)
+        if not os.path.exists(dest):
+            with _lock_for(dest):
+                if not os.path.exists(dest):
+                    _render_thumbnail(src, dest, size)
+        gerados[size] = dest
+    return gerados
+
+
+def get_thumbnail(foto, size=DEFAULT_THUMB_SIZE):
+    """
+    Caminho da miniatura de uma foto de produto (nome relativo a ASSETS_DIR).
+    Fotos antigas ganham a miniatura na primeira exibição. Retorna None se a
+    foto não existir e o próprio original se ela não puder ser reduzida.
+    """
+    if not foto:
+        return None
+    src = os.path.join(ASSETS_DIR, foto)
+    if not os.path.exists(src):
+        return None
+    try:
+        return generate_thumbnails(src, (size,))[size]
+    except Exception:
+        return src
+
+
+# Tempo de carregar/gerar miniaturas aparece no painel de diagnóstico
+get_thumbnail = instrumentar(get_thumbnail, tipo="imagem")